@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the CTFd API used by the benchmarks.
+
+Implements the /api/v1 endpoints ctfd.CTFd calls and serves uploaded files, keeping everything in memory.
+Every call the stub receives, including failed ones, is counted per method and endpoint. Calls can be slowed down or
+failed on purpose:
+* latency - seconds added to every call, plus up to jitter seconds at random
+* error_rate - share of calls answered with 502 Bad Gateway, POST calls are not retried so builds may fail
+* throttle_rate - share of calls answered with 429 Too Many Requests and Retry-After: 0
+
+    % python bench/ctfd_stub.py --port 8000 --latency 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from collections import Counter
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# fields of a challenge that the admin challenge list returns, state, description and the rest are only returned by
+# the challenge itself
+LIST_FIELDS = ('id', 'type', 'name', 'value', 'solves', 'solved_by_me', 'category', 'tags', 'template', 'script')
+
+
+class StubCTFd:
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, throttle_rate=0.0, port=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.calls = Counter()
+        self._port = port
+        self._server = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def reset(self):
+        # forget everything that was created, as if CTFd was freshly installed
+        with self._lock:
+            self._ids = Counter()
+            self.challenges = {}
+            self.flags = {}
+            self.hints = {}
+            self.tags = {}
+            self.pages = {}
+            self.files = {}
+            self.configs = {'ctf_version': '3.7.0', 'next_update_check': 1}
+            self.calls.clear()
+
+    def start(self):
+        # every stub gets its own handler class so several stubs can run side by side
+        handler = type('Handler', (StubHandler,), {'stub': self})
+        self._server = ThreadingHTTPServer(('127.0.0.1', self._port), handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def mutations(self):
+        return sum(count for call, count in self.calls.items() if not call.startswith('GET '))
+
+    def _next_id(self, kind):
+        self._ids[kind] += 1
+        return self._ids[kind]
+
+    def handle(self, method, path, body, content_type):
+        """
+        Returns the status code and decoded response of an API call, runs under the stub lock.
+        """
+        parts = path.split('/')
+        if parts[0] == 'challenges':
+            return self._challenges(method, parts, body)
+        if parts[0] in ('flags', 'hints', 'tags'):
+            return self._items(method, parts, body)
+        if parts[0] == 'configs':
+            if method == 'PATCH':
+                self.configs.update(body)
+                return 200, None
+            return 200, [{'key': key, 'value': value} for key, value in self.configs.items()]
+        if parts[0] == 'pages':
+            return self._pages(method, parts, body)
+        if parts[0] == 'files':
+            if method == 'GET':
+                return 200, [self._public(file) for file in self.files.values()]
+            return 200, [self._public(self._upload(body, content_type))]
+        return 404, None
+
+    def download(self, location):
+        for file in self.files.values():
+            if file['location'] == location:
+                return file['_content']
+        return None
+
+    def _challenges(self, method, parts, body):
+        if len(parts) == 1:
+            if method == 'GET':
+                tags = {}
+                for tag in self.tags.values():
+                    tags.setdefault(tag['challenge_id'], []).append({'value': tag['value']})
+                return 200, [self._listed(challenge, tags.get(challenge['id'], []))
+                             for challenge in self.challenges.values()]
+            challenge = {'state': 'visible', 'connection_info': None, 'next_id': None, 'max_attempts': 0,
+                         'requirements': None}
+            challenge.update(body)
+            challenge['id'] = self._next_id('challenges')
+            self.challenges[challenge['id']] = challenge
+            return 200, dict(challenge)
+        if parts[1] == 'types':
+            return 200, {'standard': {}}
+        challenge = self.challenges.get(int(parts[1]))
+        if challenge is None:
+            return 404, None
+        if len(parts) == 2:
+            if method == 'PATCH':
+                challenge.update(body)
+            details = {key: value for key, value in challenge.items() if key != 'requirements'}
+            details.update(type_data={}, view='', solves=0, solved_by_me=False, attempts=0, files=[],
+                           tags=[tag['value'] for tag in self.tags.values() if tag['challenge_id'] == challenge['id']],
+                           hints=[{'id': hint['id'], 'cost': hint['cost'], 'content': hint['content']}
+                                  for hint in self.hints.values() if hint['challenge_id'] == challenge['id']])
+            return 200, details
+        if parts[2] == 'requirements':
+            return 200, challenge.get('requirements') or {}
+        store = getattr(self, parts[2])
+        return 200, [dict(item) for item in store.values() if item['challenge_id'] == challenge['id']]
+
+    def _items(self, method, parts, body):
+        store = getattr(self, parts[0])
+        if len(parts) == 1:
+            if method == 'GET':
+                # like CTFd the admin hint list leaves out the hint content
+                return 200, [{key: value for key, value in item.items() if key != 'content' or parts[0] != 'hints'}
+                             for item in store.values()]
+            defaults = {'flags': {'type': 'static', 'data': ''},
+                        'hints': {'type': 'standard', 'cost': 0, 'requirements': {'prerequisites': []}},
+                        'tags': {}}[parts[0]]
+            item = dict(defaults, **body)
+            item['id'] = self._next_id(parts[0])
+            item['challenge'] = item['challenge_id']
+            store[item['id']] = item
+            return 200, dict(item)
+        item = store.get(int(parts[1]))
+        if item is None:
+            return 404, None
+        if method == 'DELETE':
+            del store[item['id']]
+            return 200, None
+        if method == 'PATCH':
+            item.update(body)
+        return 200, dict(item)
+
+    @staticmethod
+    def _listed(challenge, tags):
+        # nobody solves challenges on the stub, the assets are where CTFd serves the challenge type plugins from
+        plugin = 'challenges' if challenge.get('type', 'standard') == 'standard' else f"{challenge['type']}_challenges"
+        listed = {'type': 'standard', 'value': None, 'solves': 0, 'solved_by_me': False, 'tags': tags,
+                  'template': f'/plugins/{plugin}/assets/view.html', 'script': f'/plugins/{plugin}/assets/view.js'}
+        listed.update({key: challenge[key] for key in LIST_FIELDS if key in challenge})
+        return listed
+
+    def _pages(self, method, parts, body):
+        if len(parts) == 1:
+            if method == 'GET':
+                return 200, [{key: value for key, value in page.items() if key != 'content'}
+                             for page in self.pages.values()]
+            page = {'files': [], 'link_target': None}
+            page.update(body)
+            page['id'] = self._next_id('pages')
+            self.pages[page['id']] = page
+            return 200, dict(page)
+        page = self.pages.get(int(parts[1]))
+        if page is None:
+            return 404, None
+        if method == 'PATCH':
+            page.update(body)
+        return 200, dict(page)
+
+    def _upload(self, body, content_type):
+        message = BytesParser().parsebytes(f'Content-Type: {content_type}\r\n\r\n'.encode() + body)
+        part = message.get_payload()[0]
+        content = part.get_payload(decode=True)
+        file = {'id': self._next_id('files'), 'type': 'standard',
+                'location': f'{uuid.uuid4().hex}/{part.get_filename()}',
+                'sha1sum': hashlib.sha1(content).hexdigest(), '_content': content}
+        self.files[file['id']] = file
+        return file
+
+    @staticmethod
+    def _public(file):
+        return {key: value for key, value in file.items() if not key.startswith('_')}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    stub = None
+
+    def setup(self):
+        super().setup()
+        # headers and body are written separately, without this every response waits for a delayed ACK
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PATCH(self):
+        self._handle('PATCH')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        stub = self.stub
+        path = urlsplit(self.path).path
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if stub.latency or stub.jitter:
+            time.sleep(stub.latency + random.uniform(0, stub.jitter))
+        if path.startswith('/files/'):
+            return self._download(path[len('/files/'):])
+        path = path[len('/api/v1/'):].strip('/')
+        stub.calls[f"{method} {re.sub(r'/[0-9]+', '/{id}', path)}"] += 1
+        chance = random.random()
+        if chance < stub.error_rate:
+            return self._send(502, b'<html>502 Bad Gateway</html>', 'text/html')
+        if chance < stub.error_rate + stub.throttle_rate:
+            return self._send(429, b'{"message": "Too Many Requests"}', 'application/json', {'Retry-After': '0'})
+        content_type = self.headers.get('Content-Type') or ''
+        if 'json' in content_type:
+            body = json.loads(body or b'null')
+        with stub._lock:
+            status, data = stub.handle(method, path, body, content_type)
+        response = {'success': status == 200}
+        if status == 200:
+            response['data'] = data
+        self._send(status, json.dumps(response).encode(), 'application/json')
+
+    def _download(self, location):
+        with self.stub._lock:
+            content = self.stub.download(location)
+        if content is None:
+            return self._send(404, b'', 'text/html')
+        ranges = re.match(r'bytes=(\d+)-$', self.headers.get('Range') or '')
+        if ranges:
+            start = int(ranges.group(1))
+            if start >= len(content):
+                return self._send(416, b'', 'text/html')
+            return self._send(206, content[start:], 'application/octet-stream')
+        self._send(200, content, 'application/octet-stream')
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Serve an in-memory stand-in for the CTFd API.')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='Port to listen on. Defaults to 8000')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Seconds added to every call. Defaults to 0')
+    parser.add_argument('-j', '--jitter', type=float, default=0.0, help='Up to this many extra seconds at random per call. Defaults to 0')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls answered with 502. Defaults to 0')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of calls answered with 429. Defaults to 0')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stub = StubCTFd(args.latency, args.jitter, args.error_rate, args.throttle_rate, args.port).start()
+    print(f'Serving the CTFd API stand-in on {stub.url}, any API key is accepted. Ctrl-C to stop.')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Synthetic schema generator for the benchmarks.
+
+Writes a schema in the ctf/ layout with any number of categories, challenges per category, flags, hints and tags per
+challenge and files. Challenge descriptions link the files and use config variables, so the build templates them like a
+real schema, and a share of the challenges requires the challenge before it in its category.
+
+    % python bench/generate_schema.py /tmp/schema --categories 20 --challenges 100 --files 50
+"""
+
+import argparse
+import json
+import os
+import random
+
+CONFIG = '''---
+config:
+  ctf_theme: core-beta
+  user_mode: users
+  paused: 1
+  ctf_name: "{{ CONFIG_ACCOUNT.title() }} CTF"
+  ctf_description: "Benchmark CTF for {{ CONFIG_ACCOUNT }}"
+'''
+
+SCHEMA_MODULE = '''def init_schema(config):
+    pass
+'''
+
+CATEGORY_MODULE = '''import time
+
+
+def parse_challenge(schema, challenge, config):
+    # simulates the work a solver does, see --solver-ms
+    time.sleep({solver_seconds})
+    return challenge
+'''
+
+
+def generate_schema(path, categories=5, challenges=20, flags=1, hints=1, tags=2, files=5, file_size=64 * 1024,
+                    prerequisites=0.2, solver_ms=0, seed=0):
+    """
+    Writes the schema to path, which must not exist yet, and returns the config to build it with.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path)
+    with open(f'{path}/config.yml', 'w') as f:
+        f.write(CONFIG)
+    with open(f'{path}/__init__.py', 'w') as f:
+        f.write(SCHEMA_MODULE)
+    with open(f'{path}/pages.yml', 'w') as f:
+        f.write('---\npages:\n- title: Rules\n  route: rules\n  format: markdown\n'
+                '  content: "Welcome to the {{ CONFIG_ACCOUNT }} CTF"\n  draft: false\n  hidden: false\n'
+                '  auth_required: false\n')
+    file_names = [f'file_{index}.bin' for index in range(files)]
+    if files:
+        os.makedirs(f'{path}/files')
+    for name in file_names:
+        with open(f'{path}/files/{name}', 'wb') as f:
+            f.write(rng.randbytes(file_size))
+    for category in range(categories):
+        directory = f'{path}/{category + 1}_category {category + 1}'
+        os.makedirs(directory)
+        with open(f'{directory}/__init__.py', 'w') as f:
+            f.write(CATEGORY_MODULE.format(solver_seconds=solver_ms / 1000))
+        lines = ['---', 'challenges:']
+        for challenge in range(challenges):
+            name = f'challenge {category + 1}.{challenge + 1}'
+            description = f'Find the flag of {name} for {{{{ CONFIG_ACCOUNT }}}}.'
+            if file_names:
+                description += f' Start with {{{{ {rng.choice(file_names)} }}}}.'
+            lines += [f'- name: {json.dumps(name)}',
+                      f'  value: {rng.choice([5, 10, 25, 50, 100])}',
+                      '  type: standard',
+                      '  state: visible',
+                      f'  description: {json.dumps(description)}']
+            if flags:
+                lines.append('  flags:')
+                for flag in range(flags):
+                    lines += ['  - type: static', f'    content: {json.dumps(f"flag-{category}-{challenge}-{flag}")}']
+            if hints:
+                lines.append('  hints:')
+                for hint in range(hints):
+                    lines += [f'  - content: {json.dumps(f"hint {hint + 1} of {name}")}', f'    cost: {hint * 5}']
+            if tags:
+                lines.append('  tags:')
+                for tag in range(tags):
+                    lines.append(f'  - value: {json.dumps(f"tag-{rng.randrange(max(1, tags * 4))}")}')
+            if challenge and rng.random() < prerequisites:
+                lines += ['  requirements:', '    prerequisites:',
+                          f'    - {json.dumps(f"challenge {category + 1}.{challenge}")}']
+        with open(f'{directory}/challenges.yml', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+    return {'schema': path, 'account': 'bench'}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Generate a synthetic CTF schema of any size.')
+    parser.add_argument('path', help='Directory to write the schema to, must not exist yet.')
+    parser.add_argument('--categories', type=int, default=5, help='Number of categories. Defaults to 5')
+    parser.add_argument('--challenges', type=int, default=20, help='Challenges per category. Defaults to 20')
+    parser.add_argument('--flags', type=int, default=1, help='Flags per challenge. Defaults to 1')
+    parser.add_argument('--hints', type=int, default=1, help='Hints per challenge. Defaults to 1')
+    parser.add_argument('--tags', type=int, default=2, help='Tags per challenge. Defaults to 2')
+    parser.add_argument('--files', type=int, default=5, help='Number of files. Defaults to 5')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='Size of every file in bytes. Defaults to 65536')
+    parser.add_argument('--prerequisites', type=float, default=0.2, help='Share of challenges that require the previous challenge in their category. Defaults to 0.2')
+    parser.add_argument('--solver-ms', type=float, default=0, help='Milliseconds every parse_challenge solver sleeps. Defaults to 0')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed, the same seed generates the same schema. Defaults to 0')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    config = generate_schema(args.path, args.categories, args.challenges, args.flags, args.hints, args.tags,
+                             args.files, args.file_size, args.prerequisites, args.solver_ms, args.seed)
+    print(json.dumps(config))
+
+
+if __name__ == '__main__':
+    main()
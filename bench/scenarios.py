@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Offline performance scenarios for CTFBuilder.
+
+Generates a synthetic schema, serves the CTFd API from bench/ctfd_stub.py and times a fresh build_ctf, a no-op
+rebuild, get_answers, get_csv and export_ctf against it. Reports the wall time and the API calls of every scenario,
+so performance changes can be measured without a real CTFd.
+
+    % python bench/scenarios.py --categories 10 --challenges 50 --latency 0.02 --workers 8
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ctfbuilder import CTFBuilder  # noqa: E402
+from ctfd import CTFd  # noqa: E402
+from ctfd_stub import StubCTFd  # noqa: E402
+from generate_schema import generate_schema  # noqa: E402
+
+SCENARIOS = ('build (fresh)', 'build (no-op)', 'answers', 'csv', 'export')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Time CTFBuilder scenarios against a local CTFd API stand-in.')
+    parser.add_argument('--categories', type=int, default=5, help='Number of categories. Defaults to 5')
+    parser.add_argument('--challenges', type=int, default=20, help='Challenges per category. Defaults to 20')
+    parser.add_argument('--flags', type=int, default=1, help='Flags per challenge. Defaults to 1')
+    parser.add_argument('--hints', type=int, default=1, help='Hints per challenge. Defaults to 1')
+    parser.add_argument('--tags', type=int, default=2, help='Tags per challenge. Defaults to 2')
+    parser.add_argument('--files', type=int, default=5, help='Number of files. Defaults to 5')
+    parser.add_argument('--file-size', type=int, default=64 * 1024, help='Size of every file in bytes. Defaults to 65536')
+    parser.add_argument('--solver-ms', type=float, default=0, help='Milliseconds every parse_challenge solver sleeps. Defaults to 0')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Seconds the stub adds to every call. Defaults to 0')
+    parser.add_argument('-j', '--jitter', type=float, default=0.0, help='Up to this many extra seconds at random per call. Defaults to 0')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of calls the stub answers with 502. Defaults to 0')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Share of calls the stub answers with 429. Defaults to 0')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='Concurrent CTFd API calls. Defaults to 1')
+    parser.add_argument('--solver-workers', type=int, default=1, help='Solver processes. Defaults to 1')
+    parser.add_argument('-r', '--runs', type=int, default=1, help='Number of runs, the median is reported. Defaults to 1')
+    parser.add_argument('--json', type=argparse.FileType('w'), help='Also write the results as JSON to this file.')
+    parser.add_argument('-s', '--scenario', action='append', choices=SCENARIOS, help='Only run this scenario, can be repeated. A fresh build always runs first.')
+    return parser.parse_args()
+
+
+def run_scenario(stub, name, function):
+    stub.calls.clear()
+    start = time.perf_counter()
+    error = None
+    try:
+        function()
+    except Exception as e:
+        error = str(e)
+    return {'scenario': name, 'wall_ms': (time.perf_counter() - start) * 1000, 'calls': sum(stub.calls.values()),
+            'mutations': stub.mutations(), 'by_endpoint': dict(stub.calls), 'error': error}
+
+
+def run(args, stub, workdir, run_index):
+    schema = f'{workdir}/schema'
+    config = generate_schema(schema, args.categories, args.challenges, args.flags, args.hints, args.tags, args.files,
+                             args.file_size, solver_ms=args.solver_ms)
+    config.update({'ctfd_url': stub.url, 'ctfd_api_key': 'bench', 'max_workers': args.workers,
+                   'solver_workers': args.solver_workers})
+
+    def builder():
+        return CTFBuilder(CTFd(config['ctfd_api_key'], config['ctfd_url'], args.workers), config)
+
+    scenarios = {
+        'build (fresh)': lambda: builder().build_ctf(schema),
+        'build (no-op)': lambda: builder().build_ctf(schema),
+        'answers': lambda: sum(1 for _ in builder().get_answers()),
+        'csv': lambda: builder().get_csv(io.StringIO()),
+        'export': lambda: builder().export_ctf(f'{workdir}/export-{run_index}'),
+    }
+    stub.reset()
+    results = []
+    for name in SCENARIOS:
+        if name == 'build (fresh)' or not args.scenario or name in args.scenario:
+            results.append(run_scenario(stub, name, scenarios[name]))
+    shutil.rmtree(workdir)
+    return results
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    stub = StubCTFd(args.latency, args.jitter, args.error_rate, args.throttle_rate).start()
+    runs = []
+    try:
+        for run_index in range(args.runs):
+            runs.append(run(args, stub, tempfile.mkdtemp(prefix='ctfdtools-bench-'), run_index))
+    finally:
+        stub.stop()
+
+    size = args.categories * args.challenges
+    print(f'{size} challenges in {args.categories} categories, {args.files} files, {args.workers} workers, '
+          f'{args.latency * 1000:.0f} ms latency, {args.runs} runs')
+    print(f'{"SCENARIO":<16}{"WALL ms":>12}{"CALLS":>8}{"MUTATIONS":>11}  ERROR')
+    summary = []
+    for index, result in enumerate(runs[0]):
+        wall = statistics.median(run[index]['wall_ms'] for run in runs)
+        errors = [run[index]['error'] for run in runs if run[index]['error']]
+        summary.append(dict(result, wall_ms=round(wall, 1), error=errors[0] if errors else None))
+        print(f'{result["scenario"]:<16}{wall:>12.1f}{result["calls"]:>8}{result["mutations"]:>11}  '
+              f'{errors[0][:60] if errors else ""}')
+    if args.json:
+        json.dump({'arguments': vars(args) | {'json': None}, 'results': summary}, args.json, indent=2)
+    sys.exit(1 if any(result['error'] for result in summary) else 0)
+
+
+if __name__ == '__main__':
+    main()
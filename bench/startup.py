@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for build.py.
+
+Runs `build.py -h` and `import ctfbuilder` in fresh interpreters and reports the median wall time next to a bare
+interpreter start. It also checks that heavy dependencies are not imported until a code path needs them.
+Exits non-zero when a deferred dependency is imported eagerly or when --max-ms is exceeded, so it can guard CI.
+
+    % python bench/startup.py --runs 20 --max-ms 100
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# dependencies only the code paths that need them may import
+DEFERRED = ['jinja2', 'pandas', 'prompt_toolkit', 'requests', 'yaml']
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Measure build.py startup time.')
+    parser.add_argument('-r', '--runs', type=int, default=10, help='Number of runs per command. Defaults to 10')
+    parser.add_argument('-m', '--max-ms', type=float, help='Fail when build.py -h takes longer than this many milliseconds over a bare interpreter start.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the slowest imports reported by python -X importtime.')
+    return parser.parse_args()
+
+
+def time_command(command, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + command, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def eager_imports():
+    code = f'import sys, build; print(",".join(m for m in {DEFERRED!r} if m in sys.modules))'
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return [module for module in result.stdout.strip().split(',') if module]
+
+
+def slowest_imports(count=10):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import build'], cwd=ROOT,
+                            capture_output=True, text=True, check=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            imports.append((int(fields[1]), fields[2].rstrip()))
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    args = parse_args()
+    results = {
+        'python -c pass': time_command(['-c', 'pass'], args.runs),
+        'import ctfbuilder': time_command(['-c', 'import ctfbuilder'], args.runs),
+        'build.py -h': time_command(['build.py', '-h'], args.runs),
+    }
+    for name, timings in results.items():
+        print(f'{name:<20} median {statistics.median(timings):7.1f} ms  '
+              f'min {min(timings):7.1f} ms  max {max(timings):7.1f} ms')
+    overhead = statistics.median(results['build.py -h']) - statistics.median(results['python -c pass'])
+    print(f'{"build.py overhead":<20} median {overhead:7.1f} ms')
+
+    if args.verbose:
+        print('\nslowest imports (cumulative):')
+        for cumulative, name in slowest_imports():
+            print(f'{cumulative / 1000:9.1f} ms {name}')
+
+    failed = False
+    eager = eager_imports()
+    if eager:
+        print(f'FAIL: importing build.py eagerly imports {", ".join(eager)}')
+        failed = True
+    if args.max_ms is not None and overhead > args.max_ms:
+        print(f'FAIL: build.py startup overhead {overhead:.1f} ms is above {args.max_ms} ms')
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
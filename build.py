@@ -4,8 +4,8 @@ import argparse
 import json
 import logging
 import sys
-from ctfbuilder import CTFBuilder
-from ctfd import CTFd
+from ctfbuilder import BUILD_OPTIONS, CTFBuilder
+from metrics import Metrics
 from os.path import isdir, isfile
 
 
@@ -33,13 +33,37 @@ def parse_args():
     parser.add_argument('-a', '--answers', action='store_true', help='Use configuration to pull latest flags from CTFd instance.')
     parser.add_argument('-e', '--export-schema', action='store_true', help='Use configuration to export running CTFd instance to schema.')
     parser.add_argument('-E', '--export-csv', action='store_true', help='Use configuration to export running CTFd challenges to CSV.')
+    parser.add_argument('-B', '--backup', help='Use configuration to compile the CTF into a CTFd backup archive at this path for the CTFd admin import, without calling CTFd.')
+    parser.add_argument('--backup-base', help='Backup exported from the CTFd version the -B/--backup archive is for, its database version, accounts and configuration are kept.')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'), default=sys.stdout, help='Write --answers or --export-csv output to this file instead of stdout.')
+    parser.add_argument('-f', '--format', choices=['text', 'json', 'yaml', 'csv', 'jsonl'], help='Output format, text, json or yaml for --answers (defaults to text) and csv or jsonl for --export-csv (defaults to csv)')
+    parser.add_argument('--watch', action='store_true', help='With -b/--build, keep running and build again whenever a file in the schema changes.')
+    parser.add_argument('--watch-interval', type=float, default=0.25, help='Seconds between checks of the schema for --watch. Defaults to 0.25')
+    parser.add_argument('--resume', action='store_true', help='Continue an interrupted --export-schema into an existing schema directory.')
     parser.add_argument('-C', '--category', help='Specify a directory name (or names in a comma separated list) within the schema to limit build to just that category. Defaults to All')
+    parser.add_argument('-w', '--workers', type=int, help='Maximum number of concurrent CTFd API calls. Overrides max_workers from config. Defaults to 1')
+    parser.add_argument('--solver-workers', type=int, help='Number of processes used to run parse_challenge solvers. Overrides solver_workers from config. Defaults to 1')
+    parser.add_argument('--solver-timeout', type=float, help='Seconds a parse_challenge solver may run before its challenge is hidden. Overrides solver_timeout from config. Defaults to no limit')
+    parser.add_argument('--no-cache', action='store_true', help='Ignore cached parse_challenge results and schema snapshots and do not update them.')
+    parser.add_argument('--clear-cache', action='store_true', help='Remove cached parse_challenge results and schema snapshots before building.')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Show the progress of the build, including the size, time and throughput of every file upload.')
+    parser.add_argument('--stats', action='store_true', help='Print call counts, latencies and transferred bytes per CTFd API endpoint to stderr when done.')
+    parser.add_argument('--stats-file', type=argparse.FileType('w'), help='Also write the CTFd API statistics to this file, for CI dashboards.')
+    parser.add_argument('--stats-format', choices=['json', 'prometheus'], default='json', help='Format of --stats-file. Defaults to json')
     return parser.parse_args()
 
 
 def main():
     args = parse_args()
 
+    if args.verbose:
+        # CTFBuilder reports its progress at INFO level
+        builder_logger = logging.getLogger('ctfbuilder')
+        builder_logger.setLevel(logging.INFO)
+        builder_handler = logging.StreamHandler(stream=sys.stdout)
+        builder_handler.setFormatter(formatter)
+        builder_logger.addHandler(builder_handler)
+
     if args.schema and not args.export_schema:
         logger.debug(f'Using schema directory of \'{args.schema}\' from CLI arguments.')
         if not isdir(args.schema):
@@ -55,33 +79,119 @@ def main():
         print(json.dumps(config))
         sys.exit(0)
 
-    if not args.build and not args.answers and not args.export_schema and not args.export_csv:
-        raise Exception('Specify one of -b/--build or -a/--answer or -e/--export-schema or -E/--export-csv arguments to take further action.')
+    if not args.build and not args.answers and not args.export_schema and not args.export_csv and not args.backup:
+        raise Exception('Specify one of -b/--build or -a/--answer or -e/--export-schema or -E/--export-csv or -B/--backup arguments to take further action.')
         sys.exit(0)
 
     logger.debug(f"Using provided config {args.config}")
-    config = json.loads(args.config.read())
-    if args.schema:
-        config['schema'] = args.schema
-    ctfd = CTFd(config['ctfd_api_key'], config['ctfd_url'])
+    config = apply_overrides(args, json.loads(args.config.read()))
+    metrics = Metrics()
+    ctfd = None
+    targets = []
+    if args.backup:
+        # the archive is compiled offline
+        if not args.backup_base:
+            raise Exception('Must specify a --backup-base exported from the CTFd version the backup is for.')
+        if args.category:
+            raise Exception('-C/--category cannot be used with -B/--backup, an import replaces every challenge.')
+    elif args.build and config.get('targets'):
+        if args.watch:
+            raise Exception('--watch builds a single CTFd instance and cannot be used with targets in the config.')
+        # every target is built from the same config, a target can only change how it is reached and built
+        for target in config['targets']:
+            if set(target) - set(BUILD_OPTIONS) or 'ctfd_url' not in target or 'ctfd_api_key' not in target:
+                raise Exception(f"Every target needs a ctfd_url and ctfd_api_key and may only set build options, "
+                                f"invalid target: {target.get('ctfd_url')}")
+            target = apply_overrides(args, {key: value for key, value in dict(config, **target).items()
+                                            if key != 'targets'})
+            targets.append(CTFBuilder(get_ctfd(target, metrics), target))
+    elif 'ctfd_url' in config:
+        ctfd = get_ctfd(config, metrics)
+    else:
+        raise Exception('The config has no ctfd_url, targets are only used by -b/--build.')
     cb = CTFBuilder(ctfd, config)
 
-    if args.build:
-        if args.category:
+    try:
+        run(args, config, cb, targets)
+    finally:
+        # statistics are reported for failed runs too, they show where a broken build spent its time
+        if args.stats:
+            sys.stderr.write(metrics.to_table())
+        if args.stats_file:
+            args.stats_file.write(metrics.to_prometheus() if args.stats_format == 'prometheus' else metrics.to_json())
+            args.stats_file.close()
+
+
+def apply_overrides(args, config):
+    if args.schema:
+        config['schema'] = args.schema
+    if args.workers:
+        config['max_workers'] = args.workers
+    if args.solver_workers:
+        config['solver_workers'] = args.solver_workers
+    if args.solver_timeout:
+        config['solver_timeout'] = args.solver_timeout
+    if args.no_cache:
+        config['cache'] = False
+    return config
+
+
+def get_ctfd(config, metrics):
+    # the CTFd client pulls in requests, only import it once a mode that talks to CTFd was chosen
+    from ctfd import CTFd
+    return CTFd(config['ctfd_api_key'], config['ctfd_url'], config.get('max_workers', 1),
+                config.get('request_timeout', 60), config.get('request_retries', 3), metrics=metrics)
+
+
+def run(args, config, cb, targets):
+    if args.backup:
+        if args.clear_cache:
+            cb.clear_cache(config['schema'])
+        cb.backup_ctf(config['schema'], args.backup, args.backup_base)
+
+    elif args.build:
+        if args.clear_cache:
+            cb.clear_cache(config['schema'])
+        if targets:
+            failed = []
+            for url, seconds, error in cb.deploy_ctf(config['schema'], targets, args.category):
+                if error:
+                    failed.append(url)
+                    print(f'{url}: build failed after {seconds:.2f}s: {error}')
+                else:
+                    print(f'{url}: build finished in {seconds:.2f}s')
+            print(f'Built {len(targets) - len(failed)} of {len(targets)} CTFd instances.')
+            if failed:
+                raise Exception(f"Build failed on {', '.join(failed)}")
+        elif args.watch:
+            print(f"Watching {config['schema']} for changes, press Ctrl-C to stop.")
+            try:
+                for changed, seconds, error in cb.watch_ctf(config['schema'], args.category, args.watch_interval):
+                    if changed:
+                        print(f"Changed: {', '.join(changed)}")
+                    if error:
+                        print(f'Build failed after {seconds:.2f}s: {error}')
+                    else:
+                        print(f'Build finished in {seconds:.2f}s')
+            except KeyboardInterrupt:
+                pass
+        elif args.category:
             cb.build_ctf(config['schema'], args.category)
         else:
             cb.build_ctf(config['schema'])
 
     elif args.answers:
-        print(cb.get_answers())
+        for answers in cb.get_answers(args.format or 'text'):
+            args.output.write(answers)
+            args.output.flush()
 
     elif args.export_csv:
-        print(cb.get_csv())
+        cb.get_csv(args.output, args.format or 'csv')
 
     elif args.export_schema:
         if not args.schema:
             raise Exception('Must specify a --schema when generating a configuration.')
-        cb.export_ctf(config['schema'])
+        cb.export_ctf(config['schema'], args.resume)
 
 
 if __name__ == "__main__":
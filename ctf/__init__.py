@@ -1,9 +1,3 @@
-from prompt_toolkit.shortcuts import radiolist_dialog
-from prompt_toolkit.shortcuts import checkboxlist_dialog
-from prompt_toolkit.shortcuts import input_dialog
-
-
-
 def init_schema(config):
     # schema is imported as a module then passed to each categories parse_challenge function
     # this function is called first.
@@ -11,6 +5,8 @@ def init_schema(config):
 
 
 def build_config(config):
+    # prompt_toolkit is only needed when generating a configuration
+    from prompt_toolkit.shortcuts import input_dialog
     config['ctfd_url'] = input_dialog(
         title='Enter CTFd URL',
         text='https://xxx.xxx.xxx.xxx:port').run()
@@ -1,17 +1,111 @@
+import copy
+import csv
+import hashlib
+import heapq
 import importlib
+import io
 import json
 import logging
 import os
-import pandas as pd
+import pickle
 import re
-import urllib
-import yaml
+import shutil
+import signal
+import threading
+import time
 import traceback
-from jinja2 import Template, DebugUndefined
+from contextlib import contextmanager
 from os import listdir
 from os.path import isdir, isfile
 
 
+# local build state (upload manifest, caches) is kept in this directory inside the schema
+CACHE_DIR = '.ctfdtools'
+
+# PyYAML and the loader/dumper built on it are imported by load_yaml the first time YAML is read or written
+yaml = None
+YamlLoader = None
+YamlDumper = None
+
+# columns written by get_csv
+CSV_FIELDS = ['name', 'description', 'category', 'value', 'type', 'state', 'max_attempts', 'flags', 'hints', 'tags']
+
+# fields of the admin challenge list recorded and checked by the remote snapshot, besides the id. The list has no state.
+SNAPSHOT_FIELDS = ('category', 'value', 'type')
+
+# columns backup_ctf writes for the schema keys CTFd stores, with the values CTFd would fill in when a key is missing
+BACKUP_COLUMNS = {
+    'challenges': ('name', 'description', 'attribution', 'connection_info', 'max_attempts', 'value', 'category', 'type',
+                   'state', 'logic'),
+    'dynamic_challenge': ('initial', 'minimum', 'decay', 'function'),
+    'flags': ('type', 'content', 'data'),
+    'hints': ('type', 'title', 'content', 'cost', 'requirements'),
+    'tags': ('value',),
+    'pages': ('title', 'route', 'content', 'draft', 'hidden', 'auth_required', 'format', 'link_target'),
+}
+BACKUP_DEFAULTS = {
+    'challenges': {'type': 'standard', 'state': 'visible', 'max_attempts': 0},
+    'dynamic_challenge': {},
+    'flags': {'type': 'static'},
+    'hints': {'type': 'standard', 'cost': 0},
+    'tags': {},
+    'pages': {'format': 'markdown', 'draft': False, 'hidden': False, 'auth_required': False},
+}
+# tables backup_ctf keeps from the base backup: the database version, the accounts and the configuration
+BACKUP_BASE_TABLES = ('alembic_version', 'users', 'teams', 'tokens', 'fields', 'field_entries', 'brackets', 'config')
+
+# config keys that only tune how the build runs, they never change what a solver produces
+BUILD_OPTIONS = ('ctfd_api_key', 'ctfd_url', 'max_workers', 'solver_workers', 'solver_timeout', 'solver_cache_size',
+                 'cache', 'request_timeout', 'request_retries', 'targets')
+
+# builder and start queue used by each solver worker process, set by _init_solver_worker
+_solver_builder = None
+_solver_started = None
+
+# the builders of a fan-out deploy share the build state files of the schema, they update them under this lock
+_cache_lock = threading.Lock()
+
+
+class SolverTimeout(Exception):
+    pass
+
+
+@contextmanager
+def time_limit(seconds):
+    """
+    Raises SolverTimeout in the running code once seconds have passed.
+    Only enforced on the main thread of platforms with SIGALRM, elsewhere it is a no-op.
+    """
+    if not seconds or not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expire(signum, frame):
+        raise SolverTimeout(f'solver ran longer than {seconds} seconds')
+
+    previous = signal.signal(signal.SIGALRM, expire)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def _init_solver_worker(schema_dir, config, started):
+    # runs once in every solver process, modules are loaded lazily by the first challenge
+    global _solver_builder, _solver_started
+    os.chdir(schema_dir)
+    _solver_builder = CTFBuilder(None, config)
+    _solver_started = started
+
+
+def _run_solver_worker(key, schema_dir, category, challenge):
+    # tell the parent the job started, its timeout is measured from here rather than from when it was queued
+    _solver_started.put(key)
+    return _solver_builder._run_solver(schema_dir, category, challenge)
+
+
 def convert_to_template(match_obj):
     if match_obj.group() is not None:
         retval = match_obj.group()
@@ -30,6 +124,88 @@ def convert_to_template(match_obj):
         return retval
 
 
+def same_value(local, remote):
+    # CTFd hands back empty values as either None or '' and stores config values as text
+    if local in (None, '') or remote in (None, ''):
+        return local in (None, '') and remote in (None, '')
+    if isinstance(local, (dict, list)) or isinstance(remote, (dict, list)):
+        return local == remote
+    return str(local) == str(remote)
+
+
+def changed_fields(local, remote):
+    """
+    Returns the fields of the local object whose value differs from the remote object.
+    Fields that only exist remotely are ignored.
+    """
+    return {key: value for key, value in local.items() if not same_value(value, remote.get(key))}
+
+
+def diff_items(local, remote, defaults=None):
+    """
+    Matches local flags, hints or tags against the remote ones on the fields set in the schema.
+    Returns the local items that are missing remotely and the remote items that are no longer wanted.
+    """
+    unmatched = list(remote)
+    missing = []
+    for item in local:
+        match = next((r for r in unmatched if not changed_fields({**(defaults or {}), **item}, r)), None)
+        if match is None:
+            missing.append(item)
+        else:
+            unmatched.remove(match)
+    return missing, unmatched
+
+
+def topological_order(requires):
+    """
+    Orders the keys of requires so every key comes after the keys it requires, otherwise keeping their order.
+    Requirements that are not keys themselves are ignored. Raises an exception naming the keys that can never
+    be ordered because they are part of, or wait on, a cycle.
+    """
+    keys = list(requires)
+    index = {key: position for position, key in enumerate(keys)}
+    waiting = {key: set(require for require in requires[key] if require in index) for key in keys}
+    dependents = {key: [] for key in keys}
+    for key in keys:
+        for require in waiting[key]:
+            dependents[require].append(key)
+    ready = [index[key] for key in keys if not waiting[key]]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        key = keys[heapq.heappop(ready)]
+        order.append(key)
+        for dependent in dependents[key]:
+            waiting[dependent].discard(key)
+            if not waiting[dependent]:
+                heapq.heappush(ready, index[dependent])
+    if len(order) < len(keys):
+        raise Exception(f"Cyclic requirements between: {', '.join(key for key in keys if waiting[key])}")
+    return order
+
+
+def state_hash(data):
+    # fingerprint of what the schema wants a challenge, page or the configuration to look like remotely
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def str_presenter(dumper, data):
     """configures yaml for dumping multiline strings
     Ref: https://stackoverflow.com/questions/8640959/how-can-i-control-what-scalar-form-pyyaml-uses-for-my-data"""
@@ -40,18 +216,32 @@ def str_presenter(dumper, data):
     return dumper.represent_scalar('tag:yaml.org,2002:str', data)
 
 
-class YamlDumper(yaml.SafeDumper):
-    # HACK: insert blank lines between top-level objects
-    # inspired by https://stackoverflow.com/a/44284819/3786245
-    def write_line_break(self, data=None):
-        super().write_line_break(data)
+def load_yaml():
+    """
+    Imports PyYAML on first use so commands that never read or write YAML skip the import.
+    Sets up the yaml, YamlLoader and YamlDumper module globals.
+    """
+    global yaml, YamlLoader, YamlDumper
+    if yaml is not None:
+        return
+
+    import yaml as module
 
-        if len(self.indents) == 2:
-            super().write_line_break()
+    class Dumper(module.SafeDumper):
+        # HACK: insert blank lines between top-level objects
+        # inspired by https://stackoverflow.com/a/44284819/3786245
+        def write_line_break(self, data=None):
+            super().write_line_break(data)
 
+            if len(self.indents) == 2:
+                super().write_line_break()
 
-yaml.add_representer(str, str_presenter)
-yaml.representer.SafeRepresenter.add_representer(str, str_presenter)
+    module.add_representer(str, str_presenter)
+    module.representer.SafeRepresenter.add_representer(str, str_presenter)
+    # libyaml's C loader is several times faster than the pure Python one, use it whenever PyYAML was built with it
+    YamlLoader = getattr(module, 'CSafeLoader', module.SafeLoader)
+    YamlDumper = Dumper
+    yaml = module
 
 
 class CTFBuilder:
@@ -62,36 +252,143 @@ class CTFBuilder:
         self._logger = logging.getLogger(__name__)
         self._schema = None
         self._files = None
+        self._templating = None
+        self._modules = {}
+        self._yaml = None
+        self._yaml_changed = False
+        self._digests = {}
+        self._solver_pool = None
+        self._solver_runs = 0
+        self._keep_solver_pool = False
+        self._schema_module = None
         self._challenges = {}
         self._pages = {}
         self._category = None
+        self._inventory = None
+        self._inventory_lock = threading.Lock()
+        self._remote = None
+        self._state = None
 
-    def build_ctf(self, schema, category=None):
-        if category is None:
-            category = ['All']
+    def build_ctf(self, schema, category=None, parsed=None):
+        """
+        Builds the CTF from the schema. parsed holds challenges that deploy_ctf already ran through the solvers,
+        they only get their file locations filled in.
+        """
         self._schema = schema
-        self._challenges = self._get_ctfd_challenges()
-        self._pages = self._get_ctfd_pages()
-        self._category = category
-        if category != ['All']:
-            try:
-                self._category = self._category.split(',')
-            except AttributeError:
-                raise Exception(f'Invalid category specification "{self._category}", must be comma separated list')
-            bad_categories = []
-            for category in self._category:
-                if not isdir(f"{self._config['schema']}/{category}"):
-                    bad_categories.append(f"{self._config['schema']}/{category}")
-            if len(bad_categories) > 0:
-                raise Exception(f"One or more category is not valid")
-        self._files = self._put_ctfd_files()
-        self._put_ctfd_pages()
-        self._put_ctfd_configuration()
-        self._put_ctfd_challenges()
-
-    def export_ctf(self, schema):
+        self._category = self._get_categories(category)
+        # a build mutates the remote CTF, so never trust an inventory from a previous run
+        self._inventory = None
+        self._remote = self._load_remote_snapshot()
+        if self._remote is not None:
+            self._challenges = {name: {'id': entry['id']} for name, entry in self._remote['challenges'].items()}
+            self._pages = {route: entry['id'] for route, entry in self._remote['pages'].items()}
+        else:
+            self._challenges = self._get_ctfd_challenges()
+            self._pages = self._get_ctfd_pages()
+        self._state = {'challenges': {}, 'pages': {}, 'config': None}
+        # the build runs as a graph of CTFd operations, see Scheduler
+        from scheduler import Scheduler
+        scheduler = Scheduler(self._ctfd.max_workers)
+        # schema YAML and files are read while the graph is planned, the operations themselves only talk to CTFd
+        self._put_ctfd_files(scheduler)
+        self._templating = None
+        # files gate every templated value, their remote locations are part of the templating variables
+        scheduler.add('templating', self._get_templating, requires=['files'])
+        self._put_ctfd_pages(scheduler)
+        self._put_ctfd_configuration(scheduler)
+        self._put_ctfd_challenges(scheduler, parsed)
+        # The snapshot is dropped before the first change is sent and recorded again once the build succeeded, so the
+        # state left behind by a failed build is never trusted. Schema errors found while planning keep it.
+        self._drop_remote_snapshot()
+        scheduler.run()
+        self._save_remote_snapshot()
+        self._save_yaml_snapshot()
+
+    def deploy_ctf(self, schema, targets, category=None):
+        """
+        Builds the same CTF on several CTFd instances, targets holds a builder with its own CTFd client for each.
+        The schema is loaded, rendered and solved once. File placeholders and build options such as
+        {{ CONFIG_CTFD_URL }} are kept for every target to fill in with its own values, without rendering again.
+        Targets build concurrently and a failed target does not stop the others. Yields (CTFd URL, seconds, error) as
+        each target finishes.
+        """
+        from concurrent.futures import ThreadPoolExecutor, as_completed
         self._schema = schema
-        if isdir(self._schema):
+        self._category = self._get_categories(category)
+        # no files are uploaded here, see _get_templating
+        self._files = None
+        self._templating = None
+        parsed = self._parse_challenges(self._get_yaml_challenges())
+        for name in ('config.yml', 'pages.yml'):
+            if isfile(f'{schema}/{name}'):
+                self._load_yaml(f'{schema}/{name}')
+        self._save_yaml_snapshot()
+        self._logger.info(f'Schema parsed, building {len(targets)} CTFd instances.')
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='deploy') as executor:
+            futures = {executor.submit(self._deploy_target, target, schema, category, parsed): target
+                       for target in targets}
+            for future in as_completed(futures):
+                seconds, error = future.result()
+                yield futures[future]._config['ctfd_url'], seconds, error
+
+    def _deploy_target(self, target, schema, category, parsed):
+        start = time.perf_counter()
+        # every target reads the YAML parsed here instead of parsing it again
+        target._yaml = self._yaml
+        try:
+            target.build_ctf(schema, category, parsed)
+        except Exception as e:
+            return time.perf_counter() - start, e
+        return time.perf_counter() - start, None
+
+    def watch_ctf(self, schema, category=None, interval=0.25, debounce=0.3):
+        """
+        Builds the CTF, then polls the schema directory every interval seconds and builds again once files changed
+        and stayed unchanged for debounce seconds. Parsed YAML, the solver processes, their modules and results and
+        the remote snapshot stay warm between builds, so a build only reads and sends what changed in the schema.
+        Yields (changed files, seconds, error) after every build, a failed build does not stop watching.
+        """
+        state = self._scan_schema(schema)
+        changed = []
+        self._keep_solver_pool = True
+        try:
+            while True:
+                start = time.perf_counter()
+                error = None
+                try:
+                    self.build_ctf(schema, category)
+                except Exception as e:
+                    error = e
+                yield changed, time.perf_counter() - start, error
+                current = state
+                while current == state:
+                    time.sleep(interval)
+                    current = self._scan_schema(schema)
+                # editors often write a file in several steps, wait until the schema settles
+                while True:
+                    time.sleep(debounce)
+                    settled = self._scan_schema(schema)
+                    if settled == current:
+                        break
+                    current = settled
+                changed = sorted(path for path in set(state) | set(current) if state.get(path) != current.get(path))
+                state = current
+        finally:
+            self._keep_solver_pool = False
+            self._close_solver_pool()
+
+    def clear_cache(self, schema):
+        self._logger.info(f'Clearing solver, schema and remote state caches in {schema}/{CACHE_DIR}')
+        shutil.rmtree(f'{schema}/{CACHE_DIR}/solvers', ignore_errors=True)
+        for name in ('yaml.pickle', 'remote.json'):
+            if isfile(f'{schema}/{CACHE_DIR}/{name}'):
+                os.remove(f'{schema}/{CACHE_DIR}/{name}')
+        self._yaml = None
+
+    def export_ctf(self, schema, resume=False):
+        self._schema = schema
+        # resuming rewrites the YAML and only downloads files that are missing or incomplete
+        if isdir(self._schema) and not resume:
             raise Exception(f'Export directory {self._schema} already exists, exiting.')
         self._export_schema()
         self._export_ctfd_pages()
@@ -99,6 +396,66 @@ class CTFBuilder:
         self._export_ctfd_files()
         self._export_ctfd_config()
 
+    def backup_ctf(self, schema, output, base):
+        """
+        Compiles the schema into a CTFd backup archive at output, for the CTFd admin import of a fresh event.
+        Nothing is sent to CTFd: challenges, flags, hints, tags, pages, files and configuration go through the same
+        YAML, solver and templating pipeline as a build and are written as CTFd tables. base is a backup exported
+        from the CTFd version the archive is for, its database version, accounts and configuration are kept.
+        """
+        self._schema = schema
+        self._category = ['All']
+        # an import replaces everything, so prerequisites can only refer to challenges in the schema
+        self._challenges = {}
+        tables = self._read_backup_base(base)
+        for table in BACKUP_COLUMNS:
+            tables[table] = []
+        tables['files'] = []
+        uploads = {}
+        if isdir(f'{schema}/files'):
+            for file in sorted(f for f in listdir(f'{schema}/files') if isfile(f'{schema}/files/{f}')):
+                path = f'{schema}/files/{file}'
+                # derived from the contents, so rebuilding the archive gives the same links and solver cache keys
+                location = f'{file_sha256(path)[:32]}/{file}'
+                tables['files'].append({'id': len(tables['files']) + 1, 'type': 'standard', 'location': location,
+                                        'sha1sum': file_sha1(path)})
+                uploads[location] = path
+        self._files = tables['files']
+        self._templating = None
+
+        challenges = self._get_yaml_challenges()
+        references = self._get_challenge_references(challenges)
+        prepared = self._prepare_challenges(self._parse_challenges(challenges))
+        # ids follow the prerequisite order, like challenges created by a build
+        ids = {name: index + 1 for index, name in enumerate(references)}
+        for name, reference in references.items():
+            challenge, flags, hints, tags = prepared[name]
+            row = self._backup_row(tables, 'challenges', challenge)
+            row['id'] = ids[name]
+            row['next_id'] = ids.get(reference['next_id'])
+            row['requirements'] = {'prerequisites': [ids[requirement] for requirement in reference['prerequisites']]} \
+                if reference['prerequisites'] else None
+            if row['type'] == 'dynamic':
+                self._backup_row(tables, 'dynamic_challenge', challenge)['id'] = ids[name]
+            for table, items in (('flags', flags), ('hints', hints), ('tags', tags)):
+                for item in items:
+                    self._backup_row(tables, table, item)['challenge_id'] = ids[name]
+
+        if isfile(f'{schema}/pages.yml'):
+            for page in self._load_yaml(f'{schema}/pages.yml')['pages']:
+                self._backup_row(tables, 'pages', self._replace_vars(page))
+        config = {item['key']: item['value'] for item in tables.get('config', [])}
+        for key, value in self._replace_vars(self._load_yaml(f'{schema}/config.yml')['config']).items():
+            # CTFd keeps every configuration value as text
+            config[key] = value if value is None else str(value)
+        tables['config'] = [{'id': index + 1, 'key': key, 'value': value}
+                            for index, (key, value) in enumerate(config.items())]
+
+        self._write_backup(output, tables, uploads)
+        self._save_yaml_snapshot()
+        self._logger.info(f"Wrote {len(tables['challenges'])} challenges, {len(tables['flags'])} flags, "
+                          f"{len(tables['pages'])} pages and {len(uploads)} files to {output}")
+
     def generate_config(self):
         # At a minimum config must contain CTFd details and schema
         config = {'ctfd_api_key': '', 'ctfd_url': '', 'schema': self._config['schema']}
@@ -112,8 +469,34 @@ class CTFBuilder:
             os.chdir(saved_dir)
         return config
 
-    def get_answers(self):
-        answers = '''
+    def get_answers(self, format='text'):
+        """
+        Yields the answer sheet in pieces as each challenge is resolved, flags come from the bulk inventory.
+        text is the classic sheet, json and yaml yield a machine readable answer key with one entry per challenge.
+        """
+        if format not in ('text', 'json', 'yaml'):
+            raise Exception(f'Unsupported answers format "{format}", must be one of text, json or yaml')
+        inventory = self._get_ctfd_inventory()
+        entries = ({'id': challenge['id'],
+                    'name': challenge['name'],
+                    'category': challenge['category'],
+                    'value': challenge.get('value'),
+                    'flags': [{'type': flag.get('type'), 'content': flag['content'], 'data': flag.get('data')}
+                              for flag in inventory['flags'].get(challenge['id'], [])]}
+                   for challenge in inventory['challenges'])
+        if format == 'json':
+            yield '['
+            for index, entry in enumerate(entries):
+                yield (',\n' if index else '\n') + json.dumps(entry)
+            yield '\n]\n'
+            return
+        if format == 'yaml':
+            load_yaml()
+            # each entry is dumped as a one item list, concatenated they form a single YAML list
+            for entry in entries:
+                yield yaml.dump([entry], sort_keys=False)
+            return
+        yield '''
                       _
                      | |
                      | |===( )   //////
@@ -134,108 +517,62 @@ class CTFBuilder:
 
         .:. challenges .:.
         '''
-        challenges = self._ctfd.get_challenge_list()
-        for challenge in challenges['data']:
-            answers = f"{answers}\n        name: {challenge['name']}"
-            answers = f"{answers}\n        category: {challenge['category']}"
-            answers = f"{answers}\n        flags:"
-            flags = self._ctfd.get_challenge_flags(challenge['id'])['data']
-            for flag in flags:
-                answers = f"{answers} {flag['content']},"
-            answers = f'{answers[:-1]}\n'
-        return answers
-
-    def get_csv(self):
-        challenges = self._ctfd.get_challenge_list()
-        output = []
-        for item in challenges['data']:
-            new_challenge = {}
-            challenge = self._ctfd.get_challenge(item['id'])['data']
-            new_challenge['name'] = challenge['name']
-            new_challenge['description'] = challenge['description']
-            new_challenge['category'] = challenge['category']
-            new_challenge['value'] = challenge['value']
-            new_challenge['type'] = challenge['value']
-            new_challenge['state'] = challenge['value']
-            new_challenge['max_attempts'] = challenge['value']
-            flags = self._ctfd.get_challenge_flags(challenge['id'])['data']
-            new_flags = []
-            for flag in flags:
-                new_flags.append(flag['content'])
-            new_challenge['flags'] = '\n'.join(new_flags)
-            hints = self._ctfd.get_challenge_hints(challenge['id'])['data']
-            new_hints = []
-            for hint in hints:
-                new_hints.append(hint['content'])
-            new_challenge['hints'] = '\n'.join(new_hints)
-            new_challenge['tags'] = ','.join(self._ctfd.get_challenge_tags(challenge['id'])['data'])
-            output.append(new_challenge)
-        df = pd.DataFrame(output)
-        return df.to_csv(index=False)
+        for entry in entries:
+            flags = ', '.join([flag['content'] for flag in entry['flags']])
+            yield f"\n        name: {entry['name']}\n        category: {entry['category']}\n        flags: {flags}\n"
+
+    def get_csv(self, output=None, format='csv'):
+        """
+        Writes one row per challenge to output as soon as its details are fetched, as CSV or as JSON lines.
+        Only a handful of challenges are held in memory at a time. Without output the rows are returned as a string.
+        """
+        if output is None:
+            output = io.StringIO()
+            self.get_csv(output, format)
+            return output.getvalue()
+        if format == 'csv':
+            writer = csv.DictWriter(output, fieldnames=CSV_FIELDS, lineterminator='\n')
+            writer.writeheader()
+            write = writer.writerow
+        elif format == 'jsonl':
+            write = lambda row: output.write(json.dumps(row) + '\n')
+        else:
+            raise Exception(f'Unsupported export format "{format}", must be one of csv or jsonl')
+        inventory = self._get_ctfd_inventory()
+        for row in self._ctfd.imap(self._get_ctfd_csv_row, inventory['challenges']):
+            write(row)
+            output.flush()
 
     def _export_ctfd_challenges(self):
-        challenges = self._ctfd.get_challenge_list()
+        """
+        Exports the challenges as a pipeline, details are fetched concurrently and each category is written
+        as soon as its last challenge arrives so only the categories still in flight are held in memory.
+        Challenge ids are resolved to names through an index built once from the challenge list.
+        """
+        inventory = self._get_ctfd_inventory()
+        names = {challenge['id']: challenge['name'] for challenge in inventory['challenges']}
+        # categories keep the numbering of their first appearance in the challenge list
+        remaining = {}
+        for challenge in inventory['challenges']:
+            remaining[challenge['category']] = remaining.get(challenge['category'], 0) + 1
+        indexes = {category: index for index, category in enumerate(remaining)}
         export_challenges = {}
-        for item in challenges['data']:
-            challenge = self._ctfd.get_challenge(item['id'])['data']
-            challenge['description'] = re.sub(r'[(\'\"]/?files/[a-f0-9]{32}/[a-zA-Z0-9\-_.?=]+[)\'\"]',
-                                              convert_to_template, challenge['description'])
-            challenge['requirements'] = self._ctfd.get_challenge_requirements(challenge['id'])['data']
-            if challenge['next_id']:
-                challenge['next_id'] = [x for x in challenges['data'] if x['id'] == challenge['next_id']][0]['name']
-            if challenge['requirements']:
-                requirements = []
-                for requirement in challenge['requirements'].get('prerequisites', []):
-                    name = [x for x in challenges['data'] if x['id'] == requirement][0]['name']
-                    requirements.append(name)
-                challenge['requirements']['prerequisites'] = requirements
-            challenge['hints'] = self._ctfd.get_challenge_hints(challenge['id'])['data']
-            for hint in challenge['hints']:
-                del hint['id']
-                del hint['challenge']
-                del hint['challenge_id']
-                if len(hint['requirements']['prerequisites']) < 1:
-                    del hint['requirements']
-            challenge['flags'] = self._ctfd.get_challenge_flags(challenge['id'])['data']
-            for flag in challenge['flags']:
-                del flag['id']
-                del flag['challenge']
-                del flag['challenge_id']
-                if not flag['data']:
-                    del flag['data']
-            del challenge['id']
-            del challenge['type_data']
-            del challenge['view']
-            del challenge['solves']
-            del challenge['solved_by_me']
-            del challenge['attempts']
-            if len(challenge['files']) < 1:
-                del challenge['files']
-            if len(challenge['hints']) < 1:
-                del challenge['hints']
-            if len(challenge['tags']) < 1:
-                del challenge['tags']
-            if not challenge['requirements']:
-                del challenge['requirements']
-            if not challenge['next_id']:
-                del challenge['next_id']
-            if not challenge['connection_info']:
-                del challenge['connection_info']
-            if challenge['max_attempts'] == 0:
-                del challenge['max_attempts']
-            category = challenge['category']
-            del challenge['category']
-            if not export_challenges.get(category):
-                export_challenges[category] = []
-            export_challenges[category].append(challenge)
-
-        for index, category in enumerate(export_challenges):
-            os.mkdir(f'{self._schema}/{index}_{category}')
-            with open(f'{self._schema}/{index}_{category}/challenges.yml', 'w') as f:
-                data = yaml.dump({'challenges': export_challenges[category]}, Dumper=YamlDumper)
-                f.write('---\n')
-                f.write(data)
-            data = '''
+        for challenge in self._ctfd.imap(lambda item: self._get_ctfd_export_challenge(item, names),
+                                         inventory['challenges']):
+            category = challenge.pop('category')
+            export_challenges.setdefault(category, []).append(challenge)
+            remaining[category] -= 1
+            if not remaining[category]:
+                self._export_ctfd_category(indexes[category], category, export_challenges.pop(category))
+
+    def _export_ctfd_category(self, index, category, challenges):
+        load_yaml()
+        os.makedirs(f'{self._schema}/{index}_{category}', exist_ok=True)
+        with open(f'{self._schema}/{index}_{category}/challenges.yml', 'w') as f:
+            data = yaml.dump({'challenges': challenges}, Dumper=YamlDumper)
+            f.write('---\n')
+            f.write(data)
+        data = '''
 def parse_challenge(schema, challenge, config):
     """
     This function will be ran on any challenge in this category at build time.
@@ -264,8 +601,8 @@ def parse_challenge(schema, challenge, config):
 
     return challenge
 '''
-            with open(f'{self._schema}/{index}_{category}/__init__.py', 'w') as f:
-                f.write(data)
+        with open(f'{self._schema}/{index}_{category}/__init__.py', 'w') as f:
+            f.write(data)
 
     def _export_ctfd_config(self):
         export_config = {'config': {}}
@@ -290,22 +627,39 @@ def parse_challenge(schema, challenge, config):
             del export_config['config']['webhooks_secret']
         if export_config['config'].get('multiple_choice_alembic_version'):
             del export_config['config']['multiple_choice_alembic_version']
+        load_yaml()
         with open(f'{self._schema}/config.yml', 'w') as f:
             data = yaml.dump(export_config)
             f.write('---\n')
             f.write(data)
 
     def _export_ctfd_files(self):
-        for file in self._ctfd.get_file_list()['data']:
-            remote = f"{self._config['ctfd_url']}/files/{file['location']}"
-            local = f"{self._schema}/files/{file['location'].split('/')[1]}"
-            urllib.request.urlretrieve(remote, local)
+        files = self._ctfd.get_file_list()['data']
+        self._logger.info(f'Downloading {len(files)} files to {self._schema}/files.')
+        for file, size in zip(files, self._ctfd.imap(self._export_ctfd_file, files)):
+            self._logger.debug(f"Saved {file['location']} ({size} bytes)")
+
+    def _export_ctfd_file(self, file):
+        local = f"{self._schema}/files/{file['location'].split('/')[1]}"
+        # CTFd 3.6+ reports a sha1sum for every upload, older versions can only be checked against Content-Length
+        if isfile(local):
+            if file.get('sha1sum'):
+                unchanged = file_sha1(local) == file['sha1sum']
+            else:
+                unchanged = self._ctfd.get_file_size(file['location']) == os.path.getsize(local)
+            if unchanged:
+                self._logger.debug(f'Skipping {local}, already downloaded')
+                return os.path.getsize(local)
+        size = self._ctfd.download_file(file['location'], local)
+        if file.get('sha1sum') and file_sha1(local) != file['sha1sum']:
+            os.remove(local)
+            raise Exception(f"Checksum mismatch for downloaded file {file['location']}")
+        return size
 
     def _export_ctfd_pages(self):
         pages = self._ctfd.get_page_list()['data']
         export_pages = {'pages': []}
-        for page in pages:
-            details = self._ctfd.get_page_details(page['id'])['data']
+        for details in self._ctfd.imap(lambda page: self._ctfd.get_page_details(page['id'])['data'], pages):
             desc = details['content']
             desc = re.sub(r'[(\'\"]/?files/[a-f0-9]{32}/[a-zA-Z0-9\-_.?=]+[)\'\"]', convert_to_template, desc)
             details['content'] = desc
@@ -315,6 +669,7 @@ def parse_challenge(schema, challenge, config):
             if not details['link_target']:
                 del details['link_target']
             export_pages['pages'].append(details)
+        load_yaml()
         data = yaml.dump(export_pages, Dumper=YamlDumper)
         with open(f'{self._schema}/pages.yml', 'w') as f:
             f.write('---\n')
@@ -322,15 +677,9 @@ def parse_challenge(schema, challenge, config):
 
     def _export_schema(self):
             self._logger.debug(f'Saving export to directory: {self._schema}')
-            os.mkdir(self._schema)
-            os.mkdir(f'{self._schema}/files')
+            os.makedirs(f'{self._schema}/files', exist_ok=True)
             with open(f'{self._schema}/__init__.py', 'w') as f:
                 data = '''
-from prompt_toolkit.shortcuts import radiolist_dialog
-from prompt_toolkit.shortcuts import checkboxlist_dialog
-from prompt_toolkit.shortcuts import input_dialog
-
-
 def init_schema(config):
     # schema is imported as a module then passed to each categories parse_challenge function
     # this function is called first.
@@ -338,6 +687,8 @@ def init_schema(config):
 
 
 def build_config(config):
+    # prompt_toolkit is only needed when generating a configuration
+    from prompt_toolkit.shortcuts import input_dialog
     config['ctfd_url'] = input_dialog(
         title='Enter CTFd URL',
         text='https://xxx.xxx.xxx.xxx:port').run()
@@ -352,26 +703,135 @@ def build_config(config):
 
     def _get_ctfd_challenges(self):
         ctf_challenges = {}
-        challenges = self._ctfd.get_challenge_list()
-        for challenge in challenges['data']:
-            data = {'id': challenge['id'], 'flags': [], 'hints': [], 'tags': []}
-            flags = self._ctfd.get_challenge_flags(challenge['id'])['data']
-            for flag in flags:
-                data['flags'].append(flag['id'])
-            hints = self._ctfd.get_challenge_hints(challenge['id'])['data']
-            for hint in hints:
-                data['hints'].append(hint['id'])
-            tags = self._ctfd.get_challenge_tags(challenge['id'])['data']
-            for tag in tags:
-                data['tags'].append(tag['id'])
-            ctf_challenges[challenge['name']] = data
+        # a build only needs the names and ids here, flags, hints and tags are fetched once something is compared
+        inventory = self._get_ctfd_inventory(items=False)
+        for challenge in inventory['challenges']:
+            ctf_challenges[challenge['name']] = {'id': challenge['id']}
         return ctf_challenges
 
+    def _get_ctfd_challenge_details(self, item):
+        challenge = self._ctfd.get_challenge(item['id'])['data']
+        challenge['requirements'] = self._ctfd.get_challenge_requirements(item['id'])['data']
+        return challenge
+
+    def _get_ctfd_csv_row(self, item):
+        challenge = self._ctfd.get_challenge(item['id'])['data']
+        inventory = self._get_ctfd_inventory()
+        new_challenge = {}
+        new_challenge['name'] = challenge['name']
+        new_challenge['description'] = challenge['description']
+        new_challenge['category'] = challenge['category']
+        new_challenge['value'] = challenge['value']
+        new_challenge['type'] = challenge['type']
+        new_challenge['state'] = challenge['state']
+        new_challenge['max_attempts'] = challenge['max_attempts']
+        flags = inventory['flags'].get(challenge['id'], [])
+        new_challenge['flags'] = '\n'.join([flag['content'] for flag in flags])
+        hints = self._get_ctfd_hints(challenge['id'])
+        new_challenge['hints'] = '\n'.join([hint['content'] for hint in hints])
+        tags = inventory['tags'].get(challenge['id'], [])
+        new_challenge['tags'] = ','.join([tag['value'] for tag in tags])
+        return new_challenge
+
+    def _get_ctfd_export_challenge(self, item, names):
+        """
+        Fetches a challenge with its hints and strips it down to the fields kept in challenges.yml.
+        """
+        challenge = self._get_ctfd_challenge_details(item)
+        inventory = self._get_ctfd_inventory()
+        challenge['description'] = re.sub(r'[(\'\"]/?files/[a-f0-9]{32}/[a-zA-Z0-9\-_.?=]+[)\'\"]',
+                                          convert_to_template, challenge['description'])
+        if challenge['next_id']:
+            challenge['next_id'] = names[challenge['next_id']]
+        if challenge['requirements']:
+            challenge['requirements']['prerequisites'] = [
+                names[requirement] for requirement in challenge['requirements'].get('prerequisites', [])]
+        challenge['hints'] = [dict(hint) for hint in self._get_ctfd_hints(challenge['id'])]
+        for hint in challenge['hints']:
+            del hint['id']
+            del hint['challenge']
+            del hint['challenge_id']
+            if len(hint['requirements']['prerequisites']) < 1:
+                del hint['requirements']
+        challenge['flags'] = [dict(flag) for flag in inventory['flags'].get(challenge['id'], [])]
+        for flag in challenge['flags']:
+            del flag['id']
+            del flag['challenge']
+            del flag['challenge_id']
+            if not flag['data']:
+                del flag['data']
+        del challenge['id']
+        del challenge['type_data']
+        del challenge['view']
+        del challenge['solves']
+        del challenge['solved_by_me']
+        del challenge['attempts']
+        if len(challenge['files']) < 1:
+            del challenge['files']
+        if len(challenge['hints']) < 1:
+            del challenge['hints']
+        if len(challenge['tags']) < 1:
+            del challenge['tags']
+        if not challenge['requirements']:
+            del challenge['requirements']
+        if not challenge['next_id']:
+            del challenge['next_id']
+        if not challenge['connection_info']:
+            del challenge['connection_info']
+        if challenge['max_attempts'] == 0:
+            del challenge['max_attempts']
+        return challenge
+
+    def _get_ctfd_hints(self, challenge_id):
+        # The admin hint list leaves out the hint content, only fall back to the per challenge
+        # endpoint for challenges that actually have hints and only when the content is needed
+        hints = self._get_ctfd_inventory()['hints'].get(challenge_id, [])
+        if any('content' not in hint for hint in hints):
+            hints = self._ctfd.get_challenge_hints(challenge_id)['data']
+            self._inventory['hints'][challenge_id] = hints
+        return hints
+
+    def _get_ctfd_inventory(self, items=True):
+        """
+        Pulls the challenge, flag, hint and tag lists from CTFd once each and groups the flags, hints
+        and tags locally by challenge_id. Reading the whole CTF costs a constant number of API calls
+        instead of three calls per challenge. With items False only the challenge list is loaded.
+        """
+        # build operations ask for the inventory from several threads, it is only loaded once
+        with self._inventory_lock:
+            if self._inventory is None:
+                self._inventory = {'challenges': self._ctfd.get_challenge_list()['data']}
+            if items and 'flags' not in self._inventory:
+                self._logger.debug('Loading challenge inventory from CTFd.')
+                grouped = {'flags': {}, 'hints': {}, 'tags': {}}
+                for key, listed in (('flags', self._ctfd.get_flag_list()['data']),
+                                    ('hints', self._ctfd.get_hint_list()['data']),
+                                    ('tags', self._ctfd.get_tag_list()['data'])):
+                    for item in listed:
+                        grouped[key].setdefault(item['challenge_id'], []).append(item)
+                self._inventory.update(grouped)
+            return self._inventory
+
+    def _get_ctfd_challenge_items(self, challenge_id, hint_content=True):
+        """
+        Returns the flags, hints and tags of a challenge that exists in CTFd. Builds limited to some categories fetch
+        them for each challenge they compare, so they cost time in proportion to those categories rather than to
+        the whole CTF. Other builds group them from the inventory, hint content is only fetched when asked for.
+        """
+        if self._category != ['All']:
+            return {'flags': self._ctfd.get_challenge_flags(challenge_id)['data'],
+                    'hints': self._ctfd.get_challenge_hints(challenge_id)['data'],
+                    'tags': self._ctfd.get_challenge_tags(challenge_id)['data']}
+        inventory = self._get_ctfd_inventory()
+        hints = self._get_ctfd_hints(challenge_id) if hint_content else inventory['hints'].get(challenge_id, [])
+        return {'flags': inventory['flags'].get(challenge_id, []), 'hints': hints,
+                'tags': inventory['tags'].get(challenge_id, [])}
+
     def _get_ctfd_pages(self):
         ctf_pages = {}
         pages = self._ctfd.get_page_list()
         for page in pages['data']:
-            ctf_pages[page['route']] = self._ctfd.get_page_details(page['id'])['data']['id']
+            ctf_pages[page['route']] = page['id']
         return ctf_pages
 
     def _get_yaml_challenges(self):
@@ -385,65 +845,514 @@ def build_config(config):
         self._logger.debug(f'Retrieved the following categories from {self._schema}: {categories}')
         challenges = {}
         for category in categories:
-            with open(f'{self._schema}/{category}/challenges.yml', 'r') as file:
-                self._logger.debug(f'Loading challenges from {self._schema}/{category}/challenges.yml')
-                challenges[category] = yaml.safe_load(file)['challenges']
+            challenges[category] = self._load_yaml(f'{self._schema}/{category}/challenges.yml')['challenges']
         return challenges
 
+    def _get_categories(self, category):
+        if category is None or category == ['All']:
+            return ['All']
+        try:
+            categories = category.split(',')
+        except AttributeError:
+            raise Exception(f'Invalid category specification "{category}", must be comma separated list')
+        bad_categories = []
+        for category in categories:
+            if not isdir(f"{self._config['schema']}/{category}"):
+                bad_categories.append(f"{self._config['schema']}/{category}")
+        if len(bad_categories) > 0:
+            raise Exception(f"One or more category is not valid")
+        return categories
+
+    def _load_yaml(self, path):
+        """
+        Parses a YAML file from the schema at most once per build and hands back a fresh copy every time,
+        callers are free to modify it. Parsed files are kept in a snapshot keyed by path, modification time
+        and size, so files that did not change since the last build are never parsed again.
+        """
+        if self._yaml is None:
+            self._yaml = {}
+            if self._config.get('cache', True):
+                try:
+                    with open(f'{self._schema}/{CACHE_DIR}/yaml.pickle', 'rb') as f:
+                        self._yaml = pickle.load(f)
+                except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+                    self._yaml = {}
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._yaml.get(path)
+        if cached is None or cached[0] != key:
+            self._logger.debug(f'Loading YAML from {path}')
+            load_yaml()
+            with open(path, 'r') as file:
+                cached = (key, yaml.load(file, Loader=YamlLoader))
+            self._yaml[path] = cached
+            self._yaml_changed = True
+        return copy.deepcopy(cached[1])
+
+    def _save_yaml_snapshot(self):
+        if not self._yaml_changed or not self._config.get('cache', True):
+            return
+        os.makedirs(f'{self._schema}/{CACHE_DIR}', exist_ok=True)
+        with open(f'{self._schema}/{CACHE_DIR}/yaml.pickle.tmp', 'wb') as f:
+            pickle.dump(self._yaml, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f'{self._schema}/{CACHE_DIR}/yaml.pickle.tmp', f'{self._schema}/{CACHE_DIR}/yaml.pickle')
+        self._yaml_changed = False
+
+    def _load_cache(self, name, default):
+        try:
+            with open(f'{self._schema}/{CACHE_DIR}/{name}', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def _update_cache(self, name, key, value):
+        # caches hold an entry per CTFd instance, the entry is replaced, or removed when value is None
+        with _cache_lock:
+            data = self._load_cache(name, {})
+            if value is None:
+                if data.pop(key, None) is None:
+                    return
+            else:
+                data[key] = value
+            self._save_cache(name, data)
+
+    def _save_cache(self, name, data):
+        os.makedirs(f'{self._schema}/{CACHE_DIR}', exist_ok=True)
+        # write to a temporary file first so an interrupted build never leaves a truncated cache behind
+        with open(f'{self._schema}/{CACHE_DIR}/{name}.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(f'{self._schema}/{CACHE_DIR}/{name}.tmp', f'{self._schema}/{CACHE_DIR}/{name}')
+
+    def _load_remote_snapshot(self):
+        """
+        Returns the remote state recorded by the last successful build against this CTFd instance when a single
+        challenge list call shows that every challenge still has the recorded id, category, value and type.
+        Otherwise returns None and the build scans CTFd in full. Fields missing from the list are not checked.
+        """
+        if not self._config.get('cache', True):
+            return None
+        snapshot = self._load_cache('remote.json', {}).get(self._config['ctfd_url'])
+        if snapshot is None:
+            return None
+        # the challenge list is kept, a build that falls back to a full scan starts from it
+        challenges = self._get_ctfd_inventory(items=False)['challenges']
+        expected = snapshot['challenges']
+        if len(challenges) != len(expected) or any(
+                challenge.get('name') not in expected or expected[challenge['name']].get('id') != challenge.get('id') or
+                changed_fields({key: expected[challenge['name']].get(key) for key in SNAPSHOT_FIELDS
+                                if key in challenge}, challenge) for challenge in challenges):
+            self._logger.info('CTFd changed since the last build, scanning all challenges and pages.')
+            return None
+        self._logger.info('CTFd matches the last build, only challenges and pages that changed in the schema are read.')
+        return snapshot
+
+    def _drop_remote_snapshot(self):
+        self._update_cache('remote.json', self._config['ctfd_url'], None)
+
+    def _save_remote_snapshot(self):
+        """
+        Records the id and state hash of every challenge and page and the configuration hash after a successful build.
+        Challenges outside the built categories keep what was recorded or scanned before.
+        """
+        if not self._config.get('cache', True):
+            return
+        if self._remote is not None:
+            challenges = dict(self._remote['challenges'])
+            pages = dict(self._remote['pages'])
+            config = self._remote['config']
+        else:
+            challenges = {challenge['name']: dict({key: challenge.get(key) for key in SNAPSHOT_FIELDS},
+                                                  id=challenge['id'], hash=None)
+                          for challenge in self._get_ctfd_inventory(items=False)['challenges']}
+            pages = {route: {'id': id, 'hash': None} for route, id in self._pages.items()}
+            config = None
+        for name, entry in self._state['challenges'].items():
+            challenges[name] = dict(entry, id=self._challenges[name]['id'])
+        for route, digest in self._state['pages'].items():
+            pages[route] = {'id': self._pages[route], 'hash': digest}
+        self._update_cache('remote.json', self._config['ctfd_url'],
+                           {'challenges': challenges, 'pages': pages, 'config': self._state['config'] or config})
+
+    @staticmethod
+    def _scan_schema(schema):
+        # modification time and size of every schema file, build state, caches and editor temporary files are ignored
+        files = {}
+        for root, directories, names in os.walk(schema):
+            directories[:] = [d for d in directories if not d.startswith('.') and d != '__pycache__']
+            for name in names:
+                if name.startswith('.') or name.endswith(('~', '.swp', '.tmp')):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[os.path.relpath(path, schema)] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def _load_module(self, name, path):
+        """
+        Imports a module from the schema the first time it is needed and hands back the same module
+        afterwards. The module is only imported again when its source file changes.
+        """
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._modules.get(path)
+        if cached is None or cached[0] != mtime:
+            self._logger.debug(f'Loading module {name} from {path}')
+            cached = (mtime, importlib.machinery.SourceFileLoader(name, path).load_module())
+            self._modules[path] = cached
+        return cached[1]
+
+    def _get_schema_module(self, schema_dir):
+        # everything initialized in the schema module will get passed into parse_challenge
+        path = f'{schema_dir}/__init__.py'
+        if not isfile(path):
+            return None
+        schema = self._load_module('schema', path)
+        # A changed file is executed again in the same module object, which resets what init_schema set up.
+        # Every load gets a new cache entry, so init_schema runs once per load.
+        loaded = self._modules[path]
+        if self._schema_module is not loaded:
+            if hasattr(schema, 'init_schema'):
+                schema.init_schema(self._config)
+            self._schema_module = loaded
+        return schema
+
+    def _get_category_module(self, schema_dir, category):
+        # Look for a custom parse_challenge function in schema/1_category/__init__.py for each category
+        path = f'{schema_dir}/{category}/__init__.py'
+        if not isfile(path):
+            return None
+        return self._load_module(category, path)
+
     def _parse_challenges(self, challenges):
+        """
+        Runs every challenge through the parse_challenge function of its category.
+        Results are cached on disk, a challenge is only solved again when the challenge, its category module,
+        the schema module or the config changed.
+        With solver_workers above 1 the solvers run in a pool of processes. A solver that fails or runs
+        longer than solver_timeout seconds only affects its own challenge.
+        """
         challenges = self._replace_vars(challenges)
-        parsed = {}
+        schema_dir = os.path.abspath(self._schema)
+        jobs = [(category, challenge) for category in challenges.keys() for challenge in challenges[category]]
+        keys = self._get_solver_cache_keys(schema_dir, jobs) if self._config.get('cache', True) else [None] * len(jobs)
+        results = [self._read_solver_cache(key) for key in keys]
+        misses = [index for index, result in enumerate(results) if result is None]
+        self._logger.debug(f'Solver cache hits: {len(jobs) - len(misses)}, misses: {len(misses)}')
+        workers = int(self._config.get('solver_workers', 1))
+        if workers > 1 and len(misses) > 1:
+            solved = self._run_solvers_parallel(schema_dir, [jobs[index] for index in misses], workers)
+        else:
+            solved = self._run_solvers(schema_dir, [jobs[index] for index in misses])
+        for index, result in zip(misses, solved):
+            results[index] = result
+            if keys[index] is not None and not result[1]:
+                self._write_solver_cache(keys[index], result[0])
+        if misses and keys and keys[0] is not None:
+            self._evict_solver_cache()
+        parsed = {category: [] for category in challenges.keys()}
+        for (category, _), (challenge, error, timed_out) in zip(jobs, results):
+            if timed_out:
+                self._logger.warning(
+                    f"Timed out parsing '{challenge['name']}' challenge in custom parse_challenge function: Error: {error}. Setting visibility to hidden.")
+                challenge['state'] = 'hidden'
+            elif error:
+                self._logger.warning(
+                    f"Failed parsing '{challenge['name']}' challenge in custom parse_challenge function: Error: {error}")
+            # If challenge has no flags, it is unsolvable. Print a warning and hide the challenge.
+            if len(challenge.get('flags', [])) < 1:
+                self._logger.warning(
+                    f"'{challenge['name']}' has no flags and is not solvable. Setting visibility to hidden.")
+                challenge['state'] = 'hidden'
+            parsed[category].append(challenge)
+        return parsed
+
+    def _get_solver_cache_keys(self, schema_dir, jobs):
+        # the key covers everything a solver can see: the challenge, the module sources and the config
+        sources = {}
+        for path in [f'{schema_dir}/__init__.py'] + [f'{schema_dir}/{category}/__init__.py' for category, _ in jobs]:
+            if path not in sources:
+                sources[path] = file_sha256(path) if isfile(path) else None
+        config = json.dumps({k: v for k, v in self._config.items() if k not in BUILD_OPTIONS}, sort_keys=True,
+                            default=str)
+        keys = []
+        for category, challenge in jobs:
+            digest = hashlib.sha256()
+            for part in (json.dumps(challenge, sort_keys=True, default=str), category,
+                         sources[f'{schema_dir}/__init__.py'], sources[f'{schema_dir}/{category}/__init__.py'], config):
+                digest.update(str(part).encode())
+                digest.update(b'\0')
+            keys.append(digest.hexdigest())
+        return keys
+
+    def _read_solver_cache(self, key):
+        if key is None:
+            return None
+        path = f'{self._schema}/{CACHE_DIR}/solvers/{key}.json'
+        try:
+            with open(path, 'r') as f:
+                challenge = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # bump the modification time, eviction removes the least recently used entries first
+        os.utime(path)
+        return challenge, None, False
+
+    def _write_solver_cache(self, key, challenge):
+        os.makedirs(f'{self._schema}/{CACHE_DIR}/solvers', exist_ok=True)
+        path = f'{self._schema}/{CACHE_DIR}/solvers/{key}.json'
+        try:
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(challenge, f)
+            os.replace(f'{path}.tmp', path)
+        except (OSError, TypeError, ValueError) as error:
+            self._logger.debug(f"Not caching solver result for '{challenge.get('name')}': {error}")
+
+    def _evict_solver_cache(self):
+        # solver_cache_size is in megabytes
+        limit = float(self._config.get('solver_cache_size', 100)) * 1024 * 1024
+        entries = []
+        for entry in os.scandir(f'{self._schema}/{CACHE_DIR}/solvers'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= limit:
+                break
+            os.remove(path)
+            total -= size
+
+    def _run_solver(self, schema_dir, category, challenge):
+        """
+        Runs a single challenge through its category solver and returns a (challenge, error, timed_out) tuple.
+        The unparsed challenge is handed back when the solver fails.
+        """
+        try:
+            schema = self._get_schema_module(schema_dir)
+            ctf = self._get_category_module(schema_dir, category)
+            if hasattr(ctf, 'parse_challenge'):
+                with time_limit(self._config.get('solver_timeout')):
+                    return ctf.parse_challenge(schema, challenge, self._config), None, False
+            return challenge, None, False
+        except SolverTimeout as error:
+            return challenge, str(error), True
+        except Exception as error:
+            traceback.print_exc()
+            return challenge, str(error), False
+
+    def _run_solvers(self, schema_dir, jobs):
         saved_dir = os.getcwd()
-        for category in challenges.keys():
-            parsed[category] = []
-            for challenge in challenges[category]:
+        # solvers run from the schema directory, the working directory is changed once for the whole stage
+        os.chdir(schema_dir)
+        try:
+            return [self._run_solver(schema_dir, category, challenge) for category, challenge in jobs]
+        finally:
+            os.chdir(saved_dir)
+
+    def _run_solvers_parallel(self, schema_dir, jobs, workers):
+        self._logger.info(f'Running challenge solvers in {workers} processes.')
+        results = [None] * len(jobs)
+        waiting = list(range(len(jobs)))
+        while waiting:
+            waiting = self._run_solver_pool(schema_dir, jobs, waiting, workers, results)
+        return results
+
+    def _run_solver_pool(self, schema_dir, jobs, indices, workers, results):
+        """
+        Runs the given jobs in the pool of solver processes and fills in their results.
+        Workers enforce the time limit themselves, a solver that ignores it is given up on 5 seconds later, counted
+        from when it actually started. Once every worker is stuck in such a solver the pool is dropped and the jobs
+        that never started are returned to run in a fresh pool.
+        """
+        import queue
+        timeout = self._config.get('solver_timeout')
+        pool, started = self._get_solver_pool(schema_dir, workers)
+        # start reports carry the run, a report left over from an earlier build is never mistaken for a job of this one
+        self._solver_runs += 1
+        run = self._solver_runs
+        stuck = True
+        try:
+            pending = {index: pool.apply_async(_run_solver_worker, ((run, index), schema_dir, *jobs[index]))
+                       for index in indices}
+            start_times = {}
+            abandoned = []
+            while pending:
                 try:
-                    # Look for a custom parse_challenge function in schema/1_category/__init__.py for each category
-                    os.chdir(f'{saved_dir}/{self._schema}')
-                    # everything initialized in the schema module will get passed into parse_challenge
-                    schema = importlib.machinery.SourceFileLoader('schema', '__init__.py').load_module()
-                    if hasattr(schema, 'init_schema'):
-                        schema.init_schema(self._config)
-                    ctf = importlib.machinery.SourceFileLoader(category, f'{category}/__init__.py').load_module()
-                    if hasattr(ctf, 'parse_challenge'):
-                        challenge = ctf.parse_challenge(schema, challenge, self._config)
-                except Exception as error:
-                    traceback.print_exc()
-                    self._logger.warning(
-                        f"Failed parsing '{challenge['name']}' challenge in custom parse_challenge function: Error: {error}")
-                finally:
-                    os.chdir(saved_dir)
-                # If challenge has no flags, it is unsolvable. Print a warning and hide the challenge.
-                if len(challenge.get('flags', [])) < 1:
-                    self._logger.warning(
-                        f"'{challenge['name']}' has no flags and is not solvable. Setting visibility to hidden.")
-                    challenge['state'] = 'hidden'
-                parsed[category].append(challenge)
-        return parsed
+                    key = started.get(timeout=0.05)
+                    if key[0] == run:
+                        start_times[key[1]] = time.monotonic()
+                    continue
+                except queue.Empty:
+                    pass
+                now = time.monotonic()
+                for index, result in list(pending.items()):
+                    if result.ready():
+                        results[index] = result.get()
+                        del pending[index]
+                    elif timeout and index in start_times and now - start_times[index] > timeout + 5:
+                        results[index] = (jobs[index][1], f'solver ran longer than {timeout} seconds', True)
+                        abandoned.append(pending.pop(index))
+                if pending and sum(not result.ready() for result in abandoned) >= workers:
+                    self._logger.debug(f'All solver processes are stuck, restarting them for {len(pending)} jobs.')
+                    return list(pending)
+            stuck = any(not result.ready() for result in abandoned)
+            return []
+        finally:
+            # a pool with a hung solver is never reused, watch_ctf keeps a healthy one for the next build
+            if stuck or not self._keep_solver_pool:
+                self._close_solver_pool()
+
+    def _get_solver_pool(self, schema_dir, workers):
+        if self._solver_pool is None:
+            import multiprocessing
+            started = multiprocessing.Queue()
+            pool = multiprocessing.Pool(workers, initializer=_init_solver_worker,
+                                        initargs=(schema_dir, self._config, started))
+            self._solver_pool = (pool, started)
+        return self._solver_pool
+
+    def _close_solver_pool(self):
+        if self._solver_pool is None:
+            return
+        pool, started = self._solver_pool
+        self._solver_pool = None
+        # terminate rather than close so hung solvers never stall the build
+        pool.terminate()
+        started.close()
+
+    def _get_templating(self):
+        # File placeholders, config variables and the jinja2 environment only change when files are uploaded,
+        # so they are worked out once and shared by every _replace_vars call
+        if self._templating is None:
+            # jinja2 is only needed once something is templated
+            from jinja2 import DebugUndefined, Environment
+            replace_vars = {}
+            for key, value in self._config.items():
+                replace_vars[f'CONFIG_{key.upper()}'] = value
+            if self._files is None:
+                # deploy_ctf solves before any target uploaded its files, the file placeholders and the build options,
+                # which differ between targets, are kept for every target to fill in
+                names = listdir(f'{self._schema}/files') if isdir(f'{self._schema}/files') else []
+                files = {name: None for name in names if isfile(f'{self._schema}/files/{name}')}
+                options = {f'CONFIG_{key.upper()}': None for key in BUILD_OPTIONS}
+                for name in options:
+                    replace_vars.pop(name, None)
+            else:
+                files = {file['location'].split('/')[1]: file['location'] for file in self._files}
+                options = {f'CONFIG_{key.upper()}': str(self._config[key]) for key in BUILD_OPTIONS
+                           if key in self._config}
+            pattern = None
+            if files or options:
+                names = sorted(list(files) + list(options), key=len, reverse=True)
+                pattern = re.compile(r'\{\{ (' + '|'.join(re.escape(name) for name in names) + r') \}\}')
+            environment = Environment(undefined=DebugUndefined, keep_trailing_newline=True)
+            self._templating = {'files': files, 'options': options, 'pattern': pattern, 'vars': replace_vars,
+                                'environment': environment, 'templates': {}}
+        return self._templating
+
+    def _replace_string(self, value, prefix, templating, render=True):
+        if templating['pattern'] is not None and '{{' in value:
+            value = templating['pattern'].sub(lambda match: self._link_file(match, prefix, templating), value)
+        if not render or ('{{' not in value and '{%' not in value):
+            return value
+        template = templating['templates'].get(value)
+        if template is None:
+            template = templating['environment'].from_string(value)
+            templating['templates'][value] = template
+        return template.render(templating['vars'])
 
-    def _replace_vars(self, data):
+    @staticmethod
+    def _link_file(match, prefix, templating):
+        name = match.group(1)
+        if name in templating['files']:
+            value = templating['files'][name]
+            if value is not None:
+                return prefix + value
+        else:
+            value = templating['options'][name]
+            if value is not None:
+                return value
+        # left for jinja to hand back unchanged
+        return '{% raw %}' + match.group(0) + '{% endraw %}'
+
+    def _replace_vars(self, data, render=True):
         """
         This function replaces the templating variables throughout the YAML
         Any file that exists in schema/files can be referenced {{ Filename.png }}
         Any config variable can be referenced {{ CONFIG_VAR_NAME }}
+        The data is walked once and only strings that contain a template are rendered.
+        With render False only file placeholders and build options are filled in, for data that was rendered before.
+        """
+        templating = self._get_templating()
+        # the ctf_logo config value is a bare file location, everywhere else files are linked under /files/
+        prefix = '' if isinstance(data, dict) and data.get('ctf_logo') else '/files/'
+
+        def replace(item):
+            if isinstance(item, str):
+                return self._replace_string(item, prefix, templating, render)
+            if isinstance(item, dict):
+                return {key: replace(value) for key, value in item.items()}
+            if isinstance(item, list):
+                return [replace(value) for value in item]
+            return item
+
+        return replace(data)
+
+    def _put_ctfd_challenges(self, scheduler, parsed=None):
+        """
+        Schedules the challenge operations. Existing challenges are fetched while files upload, the solvers run
+        once templating is ready and then add an operation per challenge and per flag, hint and tag.
+        Challenges are created in prerequisite order, so requirements and next_id are sent with the challenge
+        itself. A next_id that points at a challenge created later is set once that challenge exists.
         """
-        for file in self._files:
-            if data.get('ctf_logo'):
-                data = json.loads(
-                    json.dumps(data).replace('{{ ' + file['location'].split('/')[1] + ' }}', file['location']))
-            else:
-                data = json.loads(json.dumps(data).replace('{{ ' + file['location'].split('/')[1] + ' }}',
-                                                           '/files/' + file['location']))
-        template = Template(json.dumps(data), undefined=DebugUndefined)
-        replace_vars = {}
-        for key, value in self._config.items():
-            replace_vars[f'CONFIG_{key.upper()}'] = value
-        data = json.loads(template.render(replace_vars))
-        return data
-
-    def _put_ctfd_challenges(self):
         self._logger.info('Building CTF categories and challenges.')
-        challenges = self._parse_challenges(self._get_yaml_challenges())
+        challenges = self._get_yaml_challenges()
+        references = self._get_challenge_references(challenges)
+        for name in references:
+            # Fetch the current state of every challenge that already exists so only the differences are sent.
+            # With a valid remote snapshot only challenges that changed since the last build are fetched, later.
+            if name in self._challenges and self._remote is None:
+                scheduler.add(f'remote:{name}', lambda name=name: self._ctfd.get_challenge(
+                    self._challenges[name]['id'])['data'])
+        # solvers change directory and may use signals, so they stay on the main thread
+        scheduler.add('solvers', lambda: self._schedule_ctfd_challenges(scheduler, challenges, references, parsed),
+                      requires=['templating'], inline=True)
+
+    def _get_challenge_references(self, challenges):
+        """
+        Checks the next_id and prerequisite names of every challenge before anything is sent to CTFd and returns
+        them keyed by challenge name, ordered so every challenge comes after its prerequisites.
+        Names have to be unique and refer to a challenge in the schema or in CTFd, prerequisites must not form a cycle.
+        """
+        references = {}
+        errors = []
+        for category in challenges.keys():
+            for challenge in challenges[category]:
+                if challenge['name'] in references:
+                    errors.append(f"Challenge name '{challenge['name']}' is used more than once")
+                references[challenge['name']] = {
+                    'next_id': challenge.get('next_id'),
+                    'prerequisites': (challenge.get('requirements') or {}).get('prerequisites', [])}
+        for name, reference in references.items():
+            for target in [reference['next_id']] + reference['prerequisites']:
+                if target and target not in references and target not in self._challenges:
+                    errors.append(f"Challenge '{name}' refers to unknown challenge '{target}'")
+        try:
+            order = topological_order({name: reference['prerequisites'] for name, reference in references.items()})
+        except Exception as error:
+            errors.append(f'Challenge prerequisites can never be met. {error}')
+            order = []
+        if errors:
+            raise Exception('Invalid challenge references:\n' + '\n'.join(errors))
+        return {name: references[name] for name in order}
+
+    def _prepare_challenges(self, challenges):
+        """
+        Splits every parsed challenge into the challenge fields and its flags, hints and tags, keyed by name.
+        next_id and requirements are left out, they refer to challenges by name, see _get_challenge_references.
+        """
+        prepared = {}
         for category in challenges.keys():
             for challenge in challenges[category]:
                 self._logger.debug(f"Parsing {challenge['name']} challenge: {challenge}")
@@ -464,94 +1373,273 @@ def build_config(config):
                     del challenge['next_id']
                 if challenge.get('requirements'):
                     del challenge['requirements']
-                if challenge['name'] in self._challenges:
-                    # Update existing challenge instead of creating new
-                    self._logger.info(f"Updating challenge named {challenge['name']}")
-                    self._ctfd.patch_challenge(challenge, self._challenges[challenge['name']]['id'])
-                    # Remove existing flags, hints, and tags
-                    # If game in progress, players will keep their existing solves
-                    for flag in self._challenges[challenge['name']]['flags']:
-                        self._ctfd.delete_flag(flag)
-                    # this is problematic if game is in progress as player will lose
-                    # hints they have already unlocked
-                    for hint in self._challenges[challenge['name']]['hints']:
-                        self._ctfd.delete_hint(hint)
-                    for tag in self._challenges[challenge['name']]['tags']:
-                        self._ctfd.delete_tag(tag)
+                prepared[challenge['name']] = (challenge, flags, hints, tags)
+        return prepared
+
+    def _schedule_ctfd_challenges(self, scheduler, challenges, references, parsed=None):
+        if parsed is None:
+            challenges = self._parse_challenges(challenges)
+        else:
+            # Solved and rendered once by deploy_ctf, only the file locations and build options of this CTFd instance
+            # are missing. The text is not rendered again, so it matches what a single build produces.
+            challenges = self._replace_vars(parsed, render=False)
+        prepared = self._prepare_challenges(challenges)
+        deferred = []
+        for name, reference in references.items():
+            challenge, flags, hints, tags = prepared[name]
+            digest = state_hash({'challenge': challenge, 'flags': flags, 'hints': hints, 'tags': tags,
+                                 'reference': reference})
+            self._state['challenges'][name] = {'category': challenge['category'], 'value': challenge.get('value'),
+                                               'type': challenge.get('type', 'standard'), 'hash': digest}
+            if self._remote is not None and self._remote['challenges'].get(name, {}).get('hash') == digest:
+                self._logger.debug(f'Skipping challenge {name}, unchanged since the last build.')
+                continue
+            # a challenge waits for the challenges it refers to that are created in this build, references is in
+            # prerequisite order so only a next_id can point at a challenge that is not scheduled yet
+            requires = [f'challenge:{target}' for target in reference['prerequisites']
+                        if target not in self._challenges]
+            next_id = reference['next_id']
+            if next_id and next_id not in self._challenges:
+                if f'challenge:{next_id}' in scheduler:
+                    requires.append(f'challenge:{next_id}')
                 else:
-                    self._logger.info(f"Creating new challenge named {challenge['name']}")
-                    self._logger.debug(challenge)
-                    data = {'id': self._ctfd.post_challenge(challenge)['data']['id'], 'flags': [], 'hints': []}
-                    self._challenges[challenge['name']] = data
-                for flag in flags:
-                    self._logger.debug(f"Posting flag to {challenge['name']} challenge: {flag}")
-                    flag['challenge_id'] = self._challenges[challenge['name']]['id']
-                    self._ctfd.post_flag(flag)
-                for hint in hints:
-                    self._logger.debug(f"Posting hint to {challenge['name']} challenge: {hint}")
-                    hint['challenge_id'] = self._challenges[challenge['name']]['id']
-                    self._ctfd.post_hint(hint)
-                for tag in tags:
-                    self._logger.debug(f"Posting tag to {challenge['name']} challenge: {tag}")
-                    tag['challenge_id'] = self._challenges[challenge['name']]['id']
-                    self._ctfd.post_tag(tag)
-
-        # now that challenges have been submitted, and we have IDs, read yaml back in and add the
-        # prerequisite requirements IDs and next challenge ID in place of challenge names
-        challenges = self._get_yaml_challenges()
-        for category in challenges.keys():
-            for challenge in challenges[category]:
-                self._logger.debug(f"Checking requirements and next_id for {challenge['name']} challenge: {challenge}")
-                update_challenge = {}
-                # Replace challenge names listed next_id with their id
-                if challenge.get('next_id'):
-                    self._logger.debug('Updating next_id with challenge id')
-                    update_challenge['next_id'] = self._challenges[challenge['next_id']]['id']
-                if challenge.get('requirements', {}).get('prerequisites'):
-                    self._logger.debug('Updating requirements with challenge ids')
-                    update_challenge['requirements'] = {}
-                    prerequisites = []
-                    for requirement in challenge['requirements']['prerequisites']:
-                        self._logger.debug(f"Adding challenge id {self._challenges[requirement]['id']}")
-                        prerequisites.append(self._challenges[requirement]['id'])
-                    update_challenge['requirements']['prerequisites'] = prerequisites
-                if len(update_challenge) > 0:
-                    self._logger.debug(f"Posting {challenge['name']} challenge: {update_challenge}")
-                    self._ctfd.patch_challenge(update_challenge, self._challenges[challenge['name']]['id'])
-
-    def _put_ctfd_configuration(self):
+                    deferred.append((name, next_id))
+                    next_id = None
+            if name in self._challenges:
+                # Update existing challenge instead of creating new, only sending what changed
+                if f'remote:{name}' not in scheduler:
+                    scheduler.add(f'remote:{name}', lambda name=name: self._ctfd.get_challenge(
+                        self._challenges[name]['id'])['data'])
+                requires.append(f'remote:{name}')
+                scheduler.add(f'challenge:{name}', lambda challenge=challenge, reference=reference:
+                              self._patch_ctfd_challenge(challenge, reference['prerequisites'], reference['next_id'],
+                                                         scheduler.result(f"remote:{challenge['name']}")),
+                              requires=requires)
+                # Only flags, hints, and tags that differ from the schema are removed or added.
+                # Unchanged hints are left alone so players keep hints they have already unlocked.
+                scheduler.add(f'items:{name}', lambda name=name, flags=flags, hints=hints, tags=tags:
+                              self._schedule_ctfd_items(scheduler, name, flags, hints, tags))
+            else:
+                scheduler.add(f'challenge:{name}', lambda challenge=challenge, reference=reference, next_id=next_id:
+                              self._post_ctfd_challenge(challenge, reference['prerequisites'], next_id),
+                              requires=requires)
+                self._schedule_ctfd_items(scheduler, name, flags, hints, tags)
+        for name, next_id in deferred:
+            scheduler.add(f'next:{name}', lambda name=name, next_id=next_id: self._patch_ctfd_next_id(name, next_id),
+                          requires=[f'challenge:{name}', f'challenge:{next_id}'])
+
+    def _schedule_ctfd_items(self, scheduler, name, flags, hints, tags):
+        deletes = []
+        if name in self._challenges:
+            remote = self._get_ctfd_challenge_items(self._challenges[name]['id'], hint_content=bool(hints))
+            flags, stale_flags = diff_items(flags, remote['flags'], {'type': 'static', 'data': None})
+            hints, stale_hints = diff_items(hints, remote['hints'])
+            tags, stale_tags = diff_items(tags, remote['tags'])
+            deletes = [('flag', self._ctfd.delete_flag, flag['id']) for flag in stale_flags]
+            deletes += [('hint', self._ctfd.delete_hint, hint['id']) for hint in stale_hints]
+            deletes += [('tag', self._ctfd.delete_tag, tag['id']) for tag in stale_tags]
+        for kind, delete, id in deletes:
+            scheduler.add(f'delete-{kind}:{id}', lambda delete=delete, id=id: delete(id))
+        posts = [('flag', self._ctfd.post_flag, flag) for flag in flags]
+        posts += [('hint', self._ctfd.post_hint, hint) for hint in hints]
+        posts += [('tag', self._ctfd.post_tag, tag) for tag in tags]
+        for index, (kind, post, item) in enumerate(posts):
+            self._logger.debug(f"Posting {kind} to {name} challenge: {item}")
+            scheduler.add(f'{kind}:{name}:{index}', lambda post=post, item=item: post(
+                dict(item, challenge_id=self._challenges[name]['id'])), requires=[f'challenge:{name}'])
+
+    def _patch_ctfd_challenge(self, challenge, prerequisites, next_id, remote):
+        challenge_id = self._challenges[challenge['name']]['id']
+        changes = changed_fields(challenge, remote)
+        # Replace challenge names listed in next_id and prerequisites with their id. Both are cleared in CTFd when
+        # the schema no longer sets them, a next_id pointing at a challenge that does not exist yet is left to
+        # _patch_ctfd_next_id.
+        if not next_id:
+            if remote.get('next_id'):
+                changes['next_id'] = None
+        elif next_id in self._challenges and remote.get('next_id') != self._challenges[next_id]['id']:
+            changes['next_id'] = self._challenges[next_id]['id']
+        prerequisites = [self._challenges[requirement]['id'] for requirement in prerequisites]
+        current = self._ctfd.get_challenge_requirements(challenge_id)['data'] or {}
+        if sorted(current.get('prerequisites') or []) != sorted(prerequisites):
+            changes['requirements'] = {'prerequisites': prerequisites} if prerequisites else {}
+        if changes:
+            self._logger.info(f"Updating challenge named {challenge['name']}")
+            self._ctfd.patch_challenge(changes, challenge_id)
+
+    def _patch_ctfd_next_id(self, name, next_id):
+        # only used when next_id points at a challenge that did not exist yet, so it always changes
+        self._logger.debug(f'Updating next_id of {name} with challenge id')
+        self._ctfd.patch_challenge({'next_id': self._challenges[next_id]['id']}, self._challenges[name]['id'])
+
+    def _post_ctfd_challenge(self, challenge, prerequisites, next_id):
+        self._logger.info(f"Creating new challenge named {challenge['name']}")
+        challenge = dict(challenge)
+        if next_id:
+            challenge['next_id'] = self._challenges[next_id]['id']
+        if prerequisites:
+            challenge['requirements'] = {
+                'prerequisites': [self._challenges[requirement]['id'] for requirement in prerequisites]}
+        self._logger.debug(challenge)
+        self._challenges[challenge['name']] = {'id': self._ctfd.post_challenge(challenge)['data']['id']}
+
+    def _put_ctfd_configuration(self, scheduler):
         self._logger.info(f'Setting initial configuration from {self._schema}/config.yml')
-        with open(f'{self._schema}/config.yml', 'r') as file:
-            ctfd_config = yaml.safe_load(file)['config']
-        ctfd_config = self._replace_vars(ctfd_config)
-        self._ctfd.patch_config_list(ctfd_config)
+        ctfd_config = self._load_yaml(f'{self._schema}/config.yml')['config']
+        requires = ['templating']
+        if self._remote is None:
+            requires.append(scheduler.add('config:remote', self._get_ctfd_config))
 
-    def _put_ctfd_files(self):
-        ctf_files = []
+        def put_config():
+            config = self._replace_vars(ctfd_config)
+            self._state['config'] = state_hash(config)
+            if self._remote is not None and self._remote['config'] == self._state['config']:
+                self._logger.debug('CTFd configuration is unchanged since the last build.')
+                return
+            remote = scheduler.result('config:remote') if 'config:remote' in scheduler else self._get_ctfd_config()
+            changes = changed_fields(config, remote)
+            if changes:
+                self._ctfd.patch_config_list(changes)
+            else:
+                self._logger.debug('CTFd configuration is already up to date.')
+
+        scheduler.add('config', put_config, requires=requires)
+
+    def _get_ctfd_config(self):
+        return {item['key']: item['value'] for item in self._ctfd.get_config_list()['data']}
+
+    def _put_ctfd_files(self, scheduler):
+        """
+        Schedules an upload for every file that changed since it was last uploaded according to the manifest.
+        The files operation completes once every upload is done, it re-uploads files whose remote copy is gone,
+        saves the manifest and leaves the remote file details in self._files for templating.
+        """
+        self._files = []
         if not isdir(f'{self._schema}/files'):
             # if files directory does not exist in schema, ignore
-            return ctf_files
+            scheduler.add('files', lambda: None)
+            return
         # sort files by leading number
         files = sorted([f for f in listdir(f'{self._schema}/files') if isfile(f'{self._schema}/files/{f}')])
         self._logger.info(f'Uploading files from {self._schema}/files.')
         self._logger.debug(f'Retrieved the following files for the CTF: {files}')
-        for file in files:
-            file = open(f"{self._schema}/files/{file}", "rb")
-            results = self._ctfd.post_file({'file': file})['data'][0]
-            ctf_files.append(results)
-        return ctf_files
+        # The manifest records the sha256 and remote location of every file uploaded to each CTFd instance.
+        # A file is only uploaded again when its contents changed or the remote copy is gone.
+        uploaded = self._load_cache('files.json', {}).get(self._config['ctfd_url'], {})
+        digests = {file: self._get_file_digest(f'{self._schema}/files/{file}') for file in files}
+        requires = []
+        # a valid remote snapshot vouches for the uploaded files as well
+        if self._remote is None:
+            requires.append(scheduler.add('files:remote', lambda: {
+                file['location']: file for file in self._ctfd.get_file_list()['data']}))
+        # the largest files are uploaded first, so a big file started last does not leave the build waiting on it
+        for file in sorted(files, key=lambda file: os.path.getsize(f'{self._schema}/files/{file}'), reverse=True):
+            entry = uploaded.get(file)
+            if not entry or entry['sha256'] != digests[file]:
+                requires.append(scheduler.add(f'file:{file}', lambda file=file: self._post_ctfd_file(file)))
+
+        def put_files():
+            remote_files = scheduler.result('files:remote') if 'files:remote' in scheduler else None
+            ctf_files = []
+            for file in files:
+                entry = uploaded.get(file)
+                if f'file:{file}' in scheduler:
+                    results = scheduler.result(f'file:{file}')
+                elif remote_files is None:
+                    ctf_files.append({'id': entry['id'], 'location': entry['location']})
+                    continue
+                elif entry['location'] in remote_files:
+                    self._logger.debug(f"Skipping unchanged file {file}, already uploaded to {entry['location']}")
+                    ctf_files.append(remote_files[entry['location']])
+                    continue
+                else:
+                    results = self._post_ctfd_file(file)
+                uploaded[file] = {'sha256': digests[file], 'location': results['location'], 'id': results['id']}
+                ctf_files.append(results)
+            self._update_cache('files.json', self._config['ctfd_url'], {file: uploaded[file] for file in files})
+            self._files = ctf_files
+
+        scheduler.add('files', put_files, requires=requires)
+
+    def _get_file_digest(self, path):
+        # like _load_yaml, a file is only hashed again when its modification time or size changed
+        stat = os.stat(path)
+        key = (stat.st_mtime_ns, stat.st_size)
+        cached = self._digests.get(path)
+        if cached is None or cached[0] != key:
+            cached = (key, file_sha256(path))
+            self._digests[path] = cached
+        return cached[1]
+
+    def _post_ctfd_file(self, file):
+        path = f'{self._schema}/files/{file}'
+        size = os.path.getsize(path)
+        start = time.perf_counter()
+        results = self._ctfd.upload_file(path)['data'][0]
+        elapsed = time.perf_counter() - start
+        self._logger.info(f'Uploaded {file}, {size / 1024 / 1024:.1f} MB in {elapsed:.2f}s '
+                          f'({size / 1024 / 1024 / max(elapsed, 1e-6):.1f} MB/s).')
+        return results
 
-    def _put_ctfd_pages(self):
+    def _put_ctfd_pages(self, scheduler):
         if not isfile(f'{self._schema}/pages.yml'):
             # if pages.yml does not exist in schema, ignore
             return
         self._logger.info(f'Loading pages from {self._schema}/pages.yml')
-        with open(f'{self._schema}/pages.yml', 'r') as file:
-            pages = yaml.safe_load(file)['pages']
+        pages = self._load_yaml(f'{self._schema}/pages.yml')['pages']
         for page in pages:
-            page = self._replace_vars(page)
-            if page['route'] in self._pages:
-                self._ctfd.patch_page(page, self._pages[page['route']])
+            route = page['route']
+            requires = ['templating']
+            if route in self._pages and self._remote is None:
+                requires.append(scheduler.add(f'page:{route}:remote', lambda route=route: self._ctfd.get_page_details(
+                    self._pages[route])['data']))
+            scheduler.add(f'page:{route}', lambda page=page: self._put_ctfd_page(scheduler, page), requires=requires)
+
+    def _put_ctfd_page(self, scheduler, page):
+        page = self._replace_vars(page)
+        route = page['route']
+        self._state['pages'][route] = state_hash(page)
+        if self._remote is not None and self._remote['pages'].get(route, {}).get('hash') == self._state['pages'][route]:
+            self._logger.debug(f'Skipping page {route}, unchanged since the last build.')
+            return
+        if route in self._pages:
+            if f'page:{route}:remote' in scheduler:
+                remote = scheduler.result(f'page:{route}:remote')
             else:
-                page = self._ctfd.post_page(page)['data']
-                self._pages[page['route']] = page['id']
+                remote = self._ctfd.get_page_details(self._pages[route])['data']
+            changes = changed_fields(page, remote)
+            if changes:
+                self._ctfd.patch_page(changes, self._pages[page['route']])
+        else:
+            page = self._ctfd.post_page(page)['data']
+            self._pages[page['route']] = page['id']
+
+    @staticmethod
+    def _read_backup_base(base):
+        import zipfile
+        with zipfile.ZipFile(base) as archive:
+            names = set(archive.namelist())
+            if 'db/alembic_version.json' not in names:
+                raise Exception(f'{base} is not a CTFd backup, it has no db/alembic_version.json')
+            return {table: json.loads(archive.read(f'db/{table}.json'))['results'] for table in BACKUP_BASE_TABLES
+                    if f'db/{table}.json' in names}
+
+    @staticmethod
+    def _backup_row(tables, table, item):
+        row = dict(BACKUP_DEFAULTS[table])
+        row.update({key: value for key, value in item.items() if key in BACKUP_COLUMNS[table]})
+        row['id'] = len(tables[table]) + 1
+        tables[table].append(row)
+        return row
+
+    def _write_backup(self, output, tables, uploads):
+        import zipfile
+        # write to a temporary file first so a failed run never leaves a truncated archive behind
+        with zipfile.ZipFile(f'{output}.tmp', 'w', zipfile.ZIP_DEFLATED) as archive:
+            for table, rows in tables.items():
+                # the layout CTFd exports its tables in
+                archive.writestr(f'db/{table}.json', json.dumps({'count': len(rows), 'results': rows, 'meta': {}}))
+            for location, path in uploads.items():
+                # files are streamed from disk into the archive
+                archive.write(path, f'uploads/{location}')
+        os.replace(f'{output}.tmp', output)
@@ -1,15 +1,109 @@
 import requests
 import logging
+import os
+import random
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from metrics import Metrics
+from requests.adapters import HTTPAdapter
+
+# methods that can safely be sent again when the first attempt may or may not have reached CTFd
+IDEMPOTENT_METHODS = ('GET', 'PATCH', 'DELETE')
+# status codes worth retrying, a load balancer in front of CTFd typically answers 502-504 while it restarts
+RETRY_STATUS = (502, 503, 504)
+MAX_BACKOFF = 30
+
+
+class MultipartFile:
+    """
+    A multipart/form-data body holding a single file that is read from disk as it is sent, so uploading a file never
+    holds more than a send buffer of it in memory. Rewinds with seek(0) for retries and closes the file on exit.
+    """
+
+    def __init__(self, path, field='file'):
+        boundary = uuid.uuid4().hex
+        filename = os.path.basename(path).replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+        self.content_type = f'multipart/form-data; boundary={boundary}'
+        self._head = (f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                      f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        self._tail = f'\r\n--{boundary}--\r\n'.encode()
+        self._size = os.path.getsize(path)
+        self._file = open(path, 'rb')
+        self._part = 0
+        self._offset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return len(self._head) + self._size + len(self._tail)
+
+    def close(self):
+        self._file.close()
+
+    def read(self, size=-1):
+        chunks = []
+        while size != 0 and self._part < 3:
+            if self._part == 1:
+                data = self._file.read(size)
+                if not data:
+                    self._part = 2
+                    continue
+            else:
+                segment = self._head if self._part == 0 else self._tail
+                end = len(segment) if size < 0 else self._offset + size
+                data = segment[self._offset:end]
+                self._offset += len(data)
+                if self._offset >= len(segment):
+                    self._part += 1
+                    self._offset = 0
+            chunks.append(data)
+            if size > 0:
+                size -= len(data)
+        return b''.join(chunks)
+
+    def seek(self, offset, whence=0):
+        if offset or whence:
+            raise ValueError('MultipartFile can only be rewound to the start')
+        self._file.seek(0)
+        self._part = 0
+        self._offset = 0
+        return 0
 
 
 class CTFd:
 
-    def __init__(self, api_key, url):
+    def __init__(self, api_key, url, max_workers=1, timeout=60, retries=3, backoff=0.5, metrics=None):
         self._api_key = api_key
         self._url = url
+        self._max_workers = max(1, int(max_workers))
+        self._timeout = timeout
+        self._retries = int(retries)
+        self._backoff = backoff
+        self._executor = None
+        # clients of a fan-out deploy share one Metrics, so the statistics cover every CTFd instance
+        self._metrics = metrics if metrics is not None else Metrics()
         self._session = requests.Session()
+        # size the connection pool to the number of workers so concurrent calls never wait on a connection
+        adapter = HTTPAdapter(pool_maxsize=self._max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
         self._logger = logging.getLogger(__name__)
 
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def metrics(self):
+        return self._metrics
+
     def delete_flag(self, id):
         return self._request(f'flags/{id}', 'DELETE')
 
@@ -19,6 +113,82 @@ class CTFd:
     def delete_tag(self, id):
         return self._request(f'tags/{id}', 'DELETE')
 
+    def download_file(self, location, path):
+        """
+        Streams an uploaded file to path in chunks over the shared session and returns the number of bytes on disk.
+        The download is written to path.part first and resumed with a Range request after a failure.
+        """
+        part = f'{path}.part'
+        attempt = 0
+        while True:
+            offset = os.path.getsize(part) if os.path.isfile(part) else 0
+            headers = {"Authorization": f"Token {self._api_key}"}
+            if offset:
+                headers['Range'] = f'bytes={offset}-'
+            start = time.perf_counter()
+            received = 0
+            try:
+                with self._session.get(f"{self._url}/files/{location}", headers=headers, stream=True,
+                                       timeout=self._timeout) as results:
+                    if results.status_code == 416 and offset:
+                        # the partial file already holds everything
+                        self._metrics.record('GET', f'files/{location}', time.perf_counter() - start)
+                        break
+                    if results.status_code in RETRY_STATUS + (429,) and attempt < self._retries:
+                        self._metrics.record('GET', f'files/{location}', time.perf_counter() - start, error=True)
+                        self._retry(f'files/{location}', 'GET', attempt, None, f'HTTP {results.status_code}',
+                                    results.headers.get('Retry-After'))
+                        attempt += 1
+                        continue
+                    if not results.ok:
+                        self._metrics.record('GET', f'files/{location}', time.perf_counter() - start, error=True)
+                    results.raise_for_status()
+                    # a server that ignores the Range header sends the whole file again
+                    mode = 'ab' if results.status_code == 206 else 'wb'
+                    expected = results.headers.get('Content-Length')
+                    expected = int(expected) + (offset if mode == 'ab' else 0) if expected else None
+                    with open(part, mode) as f:
+                        for chunk in results.iter_content(chunk_size=1024 * 1024):
+                            f.write(chunk)
+                            received += len(chunk)
+                self._metrics.record('GET', f'files/{location}', time.perf_counter() - start, received=received)
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as error:
+                self._metrics.record('GET', f'files/{location}', time.perf_counter() - start, received=received,
+                                     error=True)
+                if attempt >= self._retries:
+                    raise
+                self._retry(f'files/{location}', 'GET', attempt, None, f'{type(error).__name__}: {error}')
+                attempt += 1
+                continue
+            if expected is not None and os.path.getsize(part) != expected:
+                if attempt >= self._retries:
+                    raise Exception(f'Download of {location} is incomplete, expected {expected} bytes '
+                                    f'but received {os.path.getsize(part)}')
+                self._retry(f'files/{location}', 'GET', attempt, None, 'incomplete download')
+                attempt += 1
+                continue
+            break
+        os.replace(part, path)
+        return os.path.getsize(path)
+
+    def get_file_size(self, location):
+        """
+        Returns the size of an uploaded file from the Content-Length of a HEAD request, or None when CTFd does not
+        report one or the request fails.
+        """
+        start = time.perf_counter()
+        try:
+            results = self._session.head(f"{self._url}/files/{location}",
+                                         headers={"Authorization": f"Token {self._api_key}"}, allow_redirects=True,
+                                         timeout=self._timeout)
+        except requests.exceptions.RequestException:
+            self._metrics.record('HEAD', f'files/{location}', time.perf_counter() - start, error=True)
+            return None
+        self._metrics.record('HEAD', f'files/{location}', time.perf_counter() - start, error=not results.ok)
+        size = results.headers.get('Content-Length')
+        return int(size) if results.ok and size else None
+
     def get_challenge(self, id):
         return self._request(f'challenges/{id}')
 
@@ -49,6 +219,12 @@ class CTFd:
     def get_file_list(self):
         return self._request('files')
 
+    def get_flag_list(self):
+        return self._request('flags')
+
+    def get_hint_list(self):
+        return self._request('hints')
+
     def get_page_details(self, id):
         return self._request(f'pages/{id}')
 
@@ -82,6 +258,13 @@ class CTFd:
     def post_file(self, files):
         return self._request(f'files', 'POST', files=files)
 
+    def upload_file(self, path):
+        """
+        Uploads the file at path, streaming it from disk instead of building the whole request in memory.
+        """
+        with MultipartFile(path) as body:
+            return self._request('files', 'POST', body=body)
+
     def post_flag(self, json):
         return self._request(f'flags', 'POST', json)
 
@@ -91,7 +274,40 @@ class CTFd:
     def post_page(self, json):
         return self._request(f'pages', 'POST', json)
 
-    def _request(self, path, method='GET', json=None, files=None):
+    def imap(self, func, items):
+        """
+        Calls func for each item with at most max_workers calls in flight and yields the results
+        in the same order as items. With a single worker every call runs inline.
+        Do not call imap from inside func, the workers are shared.
+        """
+        if self._max_workers < 2:
+            for item in items:
+                yield func(item)
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='ctfd')
+        pending = deque()
+        try:
+            for item in items:
+                pending.append(self._executor.submit(func, item))
+                if len(pending) >= self._max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def map(self, func, items):
+        return list(self.imap(func, items))
+
+    def _request(self, path, method='GET', json=None, files=None, body=None):
+        """
+        Sends a single CTFd API call over the shared session and returns the decoded response.
+        Calls are retried with jittered exponential backoff when CTFd answers 429, honouring Retry-After,
+        and, for idempotent methods, on connection errors, timeouts and 502/503/504 responses.
+        POST is only retried when the request provably never reached CTFd.
+        """
         self._logger.debug(f'Hitting CTFd API endpoint {path} with {method} method.')
         headers = {
             "Authorization": f"Token {self._api_key}",
@@ -100,18 +316,74 @@ class CTFd:
         # if using files variable the correct Content-Type will be added by the requests library
         if files:
             del headers['Content-Type']
-
-        results = self._session.request(
-            method,
-            f"{self._url}/api/v1/{path}",
-            headers=headers,
-            json=json,
-            files=files
-        )
-        if results.json().get('success') is not True:
-            raise Exception(f"{results.json()}")
-
-        try:
-            return results.json()
-        except:
-            raise Exception(f'CTFd API call unexpectedly returned a non-JSON object. Message: {results.text}')
+        if body is not None:
+            headers['Content-Type'] = body.content_type
+        # uploads have to be sent again from the start of the file when a call is retried
+        streams = list((files or {}).values()) + ([body] if body is not None else [])
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                results = self._session.request(
+                    method,
+                    f"{self._url}/api/v1/{path}",
+                    headers=headers,
+                    json=json,
+                    files=files,
+                    data=body,
+                    timeout=self._timeout
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout) as error:
+                self._metrics.record(method, path, time.perf_counter() - start, error=True)
+                retryable = method in IDEMPOTENT_METHODS or isinstance(error, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt >= self._retries:
+                    raise
+                self._retry(path, method, attempt, streams, f'{type(error).__name__}: {error}')
+                attempt += 1
+                continue
+
+            self._metrics.record(method, path, time.perf_counter() - start,
+                                 int(results.request.headers.get('Content-Length') or 0), len(results.content),
+                                 error=not results.ok)
+            if attempt < self._retries and (results.status_code == 429 or (
+                    results.status_code in RETRY_STATUS and method in IDEMPOTENT_METHODS)):
+                results.close()
+                self._retry(path, method, attempt, streams, f'HTTP {results.status_code}',
+                            results.headers.get('Retry-After'))
+                attempt += 1
+                continue
+            # a retried DELETE that is gone already most likely succeeded on an earlier attempt
+            if method == 'DELETE' and attempt > 0 and results.status_code == 404:
+                return {'success': True, 'data': None}
+
+            try:
+                body = results.json()
+            except ValueError:
+                raise Exception(f'CTFd API call unexpectedly returned a non-JSON object. Message: {results.text}')
+            if not isinstance(body, dict) or body.get('success') is not True:
+                raise Exception(f"{body}")
+            return body
+
+    def _retry(self, path, method, attempt, streams, reason, retry_after=None):
+        delay = None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    delay = None
+        if delay is None:
+            # full jitter keeps concurrent workers from retrying in lockstep
+            delay = random.uniform(0, min(MAX_BACKOFF, self._backoff * 2 ** attempt))
+        delay = max(0, min(delay, MAX_BACKOFF))
+        self._metrics.retry(method, path)
+        self._logger.warning(f'CTFd API call {method} {path} failed with {reason}, retrying in {delay:.1f}s '
+                             f'(attempt {attempt + 1} of {self._retries}).')
+        for stream in streams or []:
+            if hasattr(stream, 'seek'):
+                stream.seek(0)
+        time.sleep(delay)
@@ -0,0 +1,142 @@
+import json
+import math
+import re
+import threading
+
+# upper bounds in seconds of the latency histogram buckets in the Prometheus output
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def endpoint_template(path):
+    """
+    Turns a concrete API path into the endpoint it belongs to, ie: challenges/12/flags?view=admin becomes
+    challenges/{id}/flags and an uploaded file location becomes files/{location}.
+    """
+    path = path.split('?')[0].strip('/')
+    if path.startswith('files/') and not path[len('files/'):].isdigit():
+        return 'files/{location}'
+    return '/'.join('{id}' if part.isdigit() else part for part in path.split('/'))
+
+
+def percentile(values, fraction):
+    # nearest rank on sorted values
+    if not values:
+        return 0
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def format_bytes(count):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if count < 1024 or unit == 'GB':
+            return f'{count:.0f}{unit}' if unit == 'B' else f'{count:.1f}{unit}'
+        count /= 1024
+
+
+class Metrics:
+    """
+    Collects per endpoint statistics of the CTFd API calls: call, error and retry counts, latencies and the number
+    of bytes sent and received. Every attempt of a retried call is recorded as a call of its own.
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, method, path, seconds, sent=0, received=0, error=False):
+        with self._lock:
+            endpoint = self._endpoint(method, path)
+            endpoint['calls'] += 1
+            endpoint['latencies'].append(seconds)
+            endpoint['sent'] += sent
+            endpoint['received'] += received
+            if error:
+                endpoint['errors'] += 1
+
+    def retry(self, method, path):
+        with self._lock:
+            self._endpoint(method, path)['retries'] += 1
+
+    def summary(self):
+        """
+        Returns one entry per method and endpoint, the endpoints that took the most time in total first.
+        Latencies are in milliseconds.
+        """
+        with self._lock:
+            endpoints = [(key, dict(value, latencies=sorted(value['latencies'])))
+                         for key, value in self._endpoints.items()]
+        summary = []
+        for (method, endpoint), value in endpoints:
+            latencies = value['latencies']
+            summary.append({'method': method, 'endpoint': endpoint, 'calls': value['calls'],
+                            'errors': value['errors'], 'retries': value['retries'],
+                            'total_ms': round(sum(latencies) * 1000, 1),
+                            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+                            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+                            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+                            'sent_bytes': value['sent'], 'received_bytes': value['received']})
+        return sorted(summary, key=lambda entry: entry['total_ms'], reverse=True)
+
+    def to_table(self):
+        rows = [('METHOD', 'ENDPOINT', 'CALLS', 'ERRORS', 'RETRIES', 'TOTAL ms', 'P50 ms', 'P95 ms', 'P99 ms', 'SENT',
+                 'RECEIVED')]
+        summary = self.summary()
+        for entry in summary:
+            rows.append((entry['method'], entry['endpoint'], entry['calls'], entry['errors'], entry['retries'],
+                         entry['total_ms'], entry['p50_ms'], entry['p95_ms'], entry['p99_ms'],
+                         format_bytes(entry['sent_bytes']), format_bytes(entry['received_bytes'])))
+        rows.append(('', 'total', sum(entry['calls'] for entry in summary),
+                     sum(entry['errors'] for entry in summary), sum(entry['retries'] for entry in summary),
+                     round(sum(entry['total_ms'] for entry in summary), 1), '', '', '',
+                     format_bytes(sum(entry['sent_bytes'] for entry in summary)),
+                     format_bytes(sum(entry['received_bytes'] for entry in summary))))
+        widths = [max(len(str(row[column])) for row in rows) for column in range(len(rows[0]))]
+        lines = []
+        for row in rows:
+            # method and endpoint are left aligned, the numbers right aligned
+            cells = [str(cell).ljust(width) if column < 2 else str(cell).rjust(width)
+                     for column, (cell, width) in enumerate(zip(row, widths))]
+            lines.append('  '.join(cells).rstrip())
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        return json.dumps({'endpoints': self.summary()}, indent=2) + '\n'
+
+    def to_prometheus(self):
+        with self._lock:
+            endpoints = [(key, dict(value, latencies=list(value['latencies'])))
+                         for key, value in self._endpoints.items()]
+        lines = []
+        counters = (('ctfd_requests_total', 'calls', 'CTFd API calls, every attempt counts.'),
+                    ('ctfd_request_errors_total', 'errors', 'CTFd API calls that failed or returned an error status.'),
+                    ('ctfd_request_retries_total', 'retries', 'CTFd API calls that were retried.'),
+                    ('ctfd_request_sent_bytes_total', 'sent', 'Bytes sent in CTFd API request bodies.'),
+                    ('ctfd_response_received_bytes_total', 'received', 'Bytes received in CTFd API response bodies.'))
+        for name, field, help in counters:
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} counter')
+            for (method, endpoint), value in endpoints:
+                lines.append(f'{name}{{{self._labels(method, endpoint)}}} {value[field]}')
+        name = 'ctfd_request_duration_seconds'
+        lines.append(f'# HELP {name} Latency of CTFd API calls.')
+        lines.append(f'# TYPE {name} histogram')
+        for (method, endpoint), value in endpoints:
+            labels = self._labels(method, endpoint)
+            for bucket in BUCKETS:
+                count = sum(1 for latency in value['latencies'] if latency <= bucket)
+                lines.append(f'{name}_bucket{{{labels},le="{bucket}"}} {count}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {len(value["latencies"])}')
+            lines.append(f'{name}_sum{{{labels}}} {sum(value["latencies"]):.6f}')
+            lines.append(f'{name}_count{{{labels}}} {len(value["latencies"])}')
+        return '\n'.join(lines) + '\n'
+
+    def _endpoint(self, method, path):
+        key = (method, endpoint_template(path))
+        if key not in self._endpoints:
+            self._endpoints[key] = {'calls': 0, 'errors': 0, 'retries': 0, 'sent': 0, 'received': 0, 'latencies': []}
+        return self._endpoints[key]
+
+    @staticmethod
+    def _labels(method, endpoint):
+        endpoint = re.sub(r'(["\\])', r'\\\1', endpoint)
+        return f'method="{method}",endpoint="{endpoint}"'
@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class Scheduler:
+    """
+    Runs a graph of operations. Every operation starts as soon as the operations it requires have completed,
+    with at most max_workers operations running at a time, so the longest chain of dependent calls rather than
+    the total number of calls decides how long the graph takes. Operations may add further operations while
+    the graph runs. With a single worker everything runs inline in the order it became ready.
+    """
+
+    def __init__(self, max_workers=1):
+        self._max_workers = max(1, int(max_workers))
+        self._lock = threading.Lock()
+        self._nodes = {}
+        self._results = {}
+        self._ready = deque()
+        self._logger = logging.getLogger(__name__)
+
+    def __contains__(self, name):
+        return name in self._nodes
+
+    def add(self, name, func, requires=(), inline=False):
+        """
+        Adds an operation named name that calls func once every operation in requires has completed.
+        Required operations must have been added before. Inline operations always run on the thread that
+        called run, for work such as changing directory or using signals that must not leave the main thread.
+        """
+        with self._lock:
+            if name in self._nodes:
+                raise Exception(f'Operation {name} was already scheduled')
+            missing = [require for require in requires if require not in self._nodes]
+            if missing:
+                raise Exception(f'Operation {name} requires unknown operations: {", ".join(missing)}')
+            waiting = set(require for require in requires if require not in self._results)
+            self._nodes[name] = {'func': func, 'waiting': waiting, 'dependents': [], 'inline': inline}
+            for require in waiting:
+                self._nodes[require]['dependents'].append(name)
+            if not waiting:
+                self._ready.append(name)
+        return name
+
+    def result(self, name):
+        return self._results[name]
+
+    def run(self):
+        """
+        Runs every operation and returns once the graph is complete. After a failure no further operations
+        are started, the ones already running are waited for and the first error is raised.
+        """
+        executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='scheduler') \
+            if self._max_workers > 1 else None
+        running = {}
+        error = None
+        try:
+            while True:
+                while error is None and self._ready and len(running) < self._max_workers:
+                    with self._lock:
+                        name = self._ready.popleft()
+                    node = self._nodes[name]
+                    self._logger.debug(f'Starting operation {name}')
+                    if executor is None or node['inline']:
+                        try:
+                            self._complete(name, node['func']())
+                        except Exception as e:
+                            error = e
+                    else:
+                        running[executor.submit(node['func'])] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        self._complete(name, future.result())
+                    except Exception as e:
+                        error = error or e
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        if error is not None:
+            raise error
+        stalled = [name for name in self._nodes if name not in self._results]
+        if stalled:
+            raise Exception(f'Operations never became ready: {", ".join(stalled)}')
+
+    def _complete(self, name, result):
+        with self._lock:
+            self._results[name] = result
+            for dependent in self._nodes[name]['dependents']:
+                waiting = self._nodes[dependent]['waiting']
+                waiting.discard(name)
+                if not waiting:
+                    self._ready.append(dependent)